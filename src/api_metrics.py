@@ -0,0 +1,312 @@
+from evernote.edam.error.ttypes import EDAMSystemException
+from mendeley.exception import MendeleyApiException
+
+from bisect import bisect_left
+from datetime import datetime
+from urlparse import urlparse
+from os import rename
+import threading
+import json
+import time
+import re
+
+# Upper bounds, in seconds, of the buckets the call latencies are counted in
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+# The job recorded for calls made outside of the events, goals, mendeley, summary and sync jobs
+DEFAULT_JOB = "other"
+
+# Google gives the reason a request was rate limited in the error body, which for a batch holds one per request
+GOOGLE_RATE_LIMIT_REASON = re.compile(r'"reason":\s*"(?:user)?[rR]ateLimitExceeded"')
+
+job_local = threading.local()
+
+
+def get_current_job():
+    return getattr(job_local, "job", DEFAULT_JOB)
+
+
+def tag_job(job_name):
+    # Decorates a function so that the API calls it makes on its thread are recorded against the job
+
+    # Held here as well as in the module, since a daemon thread can still be running while the module is torn down
+    local = job_local
+
+    def decorator(function):
+        def tagged_function(*args, **kwargs):
+            previous_job = getattr(local, "job", DEFAULT_JOB)
+            local.job = job_name
+            try:
+                return function(*args, **kwargs)
+            finally:
+                local.job = previous_job
+        return tagged_function
+
+    return decorator
+
+
+def propagate_job(function):
+    # Wraps a function which is to be run on another thread, e.g. by a thread pool,
+    # so the calls it makes are recorded against the job which started it
+    return tag_job(get_current_job())(function)
+
+
+def get_request_method_name(method, url):
+    # Names a REST call by its HTTP method and path, with the ids in the path replaced so calls to
+    # different documents or events are counted together, e.g. "PATCH /calendar/v3/calendars/primary/events/{id}"
+
+    segments = ["{id}" if len(segment) >= 16 and re.search(r"\d", segment) else segment
+                for segment in urlparse(url).path.split("/")]
+
+    return method.upper() + " " + "/".join(segments)
+
+
+def get_body_size(body):
+
+    if isinstance(body, basestring):
+        return len(body)
+
+    return 0
+
+
+class ApiMetrics():
+    # Counts the calls made to each method of each service by each job, along with how long they took,
+    # the bytes sent and received and how many were rejected for exceeding the rate limit.
+    # Calls are recorded from every job's threads, and the counts cover the life of the process.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.methods = {}
+
+    def record(self, service, method_name, latency, bytes_sent=0, bytes_received=0, rate_limit_hits=0, failed=False):
+
+        key = (get_current_job(), service, method_name)
+
+        with self.lock:
+            method_metrics = self.methods.get(key)
+            if method_metrics is None:
+                method_metrics = {"calls": 0, "failures": 0, "rate_limit_hits": 0, "bytes_sent": 0,
+                                  "bytes_received": 0, "latency_sum": 0.0,
+                                  "latency_buckets": [0] * (len(LATENCY_BUCKETS) + 1)}
+                self.methods[key] = method_metrics
+
+            method_metrics["calls"] += 1
+            method_metrics["failures"] += 1 if failed else 0
+            method_metrics["rate_limit_hits"] += rate_limit_hits
+            method_metrics["bytes_sent"] += bytes_sent
+            method_metrics["bytes_received"] += bytes_received
+            method_metrics["latency_sum"] += latency
+            method_metrics["latency_buckets"][bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    def get_snapshot(self):
+        # Returns a list of the metrics for each (job, service, method), with the latency buckets
+        # counting every call at least as fast as their bound, as Prometheus histograms do
+
+        with self.lock:
+            methods = sorted((key, dict(method_metrics, latency_buckets=list(method_metrics["latency_buckets"])))
+                             for key, method_metrics in self.methods.items())
+
+        snapshot = []
+        for (job, service, method_name), method_metrics in methods:
+
+            cumulative_buckets = []
+            calls = 0
+            for bound, bucket_calls in zip(LATENCY_BUCKETS + ["+Inf"], method_metrics["latency_buckets"]):
+                calls += bucket_calls
+                cumulative_buckets.append([str(bound), calls])
+
+            method_metrics["latency_buckets"] = cumulative_buckets
+            method_metrics.update(job=job, service=service, method=method_name)
+            snapshot.append(method_metrics)
+
+        return snapshot
+
+    def format_json(self):
+        return json.dumps({"time": datetime.now().strftime("%Y%m%dT%H%M%S"), "methods": self.get_snapshot()},
+                          indent=2, sort_keys=True)
+
+    def format_prometheus(self):
+        # The job is labelled job_name, as Prometheus sets the job label itself when it scrapes
+
+        counters = [("api_calls_total", "calls", "API calls made"),
+                    ("api_call_failures_total", "failures", "API calls which raised an error"),
+                    ("api_rate_limit_hits_total", "rate_limit_hits", "API calls rejected for exceeding the rate limit"),
+                    ("api_bytes_sent_total", "bytes_sent", "Bytes sent in API requests"),
+                    ("api_bytes_received_total", "bytes_received", "Bytes received in API responses")]
+
+        snapshot = self.get_snapshot()
+        lines = []
+
+        def get_labels(method_metrics, extra_labels=""):
+            return '{job_name="%s",service="%s",method="%s"%s}' % (method_metrics["job"], method_metrics["service"],
+                                                                   method_metrics["method"], extra_labels)
+
+        for metric_name, field, description in counters:
+            lines.append("# HELP " + metric_name + " " + description)
+            lines.append("# TYPE " + metric_name + " counter")
+            for method_metrics in snapshot:
+                lines.append(metric_name + get_labels(method_metrics) + " " + str(method_metrics[field]))
+
+        lines.append("# HELP api_call_latency_seconds Time taken by API calls")
+        lines.append("# TYPE api_call_latency_seconds histogram")
+        for method_metrics in snapshot:
+            for bound, calls in method_metrics["latency_buckets"]:
+                lines.append("api_call_latency_seconds_bucket" + get_labels(method_metrics, ',le="' + bound + '"')
+                             + " " + str(calls))
+            lines.append("api_call_latency_seconds_sum" + get_labels(method_metrics) + " "
+                         + repr(method_metrics["latency_sum"]))
+            lines.append("api_call_latency_seconds_count" + get_labels(method_metrics) + " "
+                         + str(method_metrics["calls"]))
+
+        return "\n".join(lines) + "\n"
+
+    def save_snapshot(self, snapshot_location):
+        # Written as Prometheus text if the file name ends in .prom, e.g. for the node exporter's textfile collector,
+        # and as JSON otherwise. A temporary file is written first so a reader never sees half a snapshot.
+
+        if snapshot_location.endswith(".prom"):
+            content = self.format_prometheus()
+        else:
+            content = self.format_json()
+
+        with open(snapshot_location + ".tmp", 'w') as f:
+            f.write(content)
+        rename(snapshot_location + ".tmp", snapshot_location)
+
+
+api_metrics = ApiMetrics()
+
+
+class ByteCountingTransport():
+    # Wraps a Thrift transport to count the bytes written to and read from it
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def write(self, buf):
+        self.bytes_sent += len(buf)
+        self.transport.write(buf)
+
+    def read(self, sz):
+        buf = self.transport.read(sz)
+        self.bytes_received += len(buf)
+        return buf
+
+    def readAll(self, sz):
+        # The wrapped transport's readAll would read past the count
+        buf = ""
+        while len(buf) < sz:
+            chunk = self.read(sz - len(buf))
+            if len(chunk) == 0:
+                raise EOFError()
+            buf += chunk
+        return buf
+
+    def __getattr__(self, name):
+        return getattr(self.transport, name)
+
+
+class InstrumentedNoteStore():
+    # Wraps a NoteStore so that every call is recorded in the metrics. The bytes are counted on the store's
+    # Thrift transport, so fake note stores, which don't have one, are recorded without them.
+
+    def __init__(self, note_store, metrics):
+        self.note_store = note_store
+        self.metrics = metrics
+        self.transport = None
+
+        client = getattr(note_store, "_client", None)
+        if client is not None:
+            self.transport = ByteCountingTransport(client._oprot.trans)
+            client._iprot.trans = client._oprot.trans = self.transport
+
+    def get_transferred_bytes(self):
+
+        if self.transport is None:
+            return 0, 0
+
+        return self.transport.bytes_sent, self.transport.bytes_received
+
+    def __getattr__(self, name):
+
+        method = getattr(self.note_store, name)
+        if not callable(method):
+            return method
+
+        def instrumented_method(*args, **kwargs):
+
+            start = time.time()
+            start_sent, start_received = self.get_transferred_bytes()
+            rate_limit_hits = 0
+            failed = True
+
+            try:
+                result = method(*args, **kwargs)
+                failed = False
+                return result
+            except EDAMSystemException as e:
+                rate_limit_hits = 0 if e.rateLimitDuration is None else 1
+                raise
+            finally:
+                sent, received = self.get_transferred_bytes()
+                self.metrics.record("evernote", name, time.time() - start, sent - start_sent,
+                                    received - start_received, rate_limit_hits, failed)
+
+        return instrumented_method
+
+
+def instrument_http(http, metrics, service):
+    # Records every request made through an httplib2 Http object, such as the one the Google API client uses.
+    # A batch request is recorded as a single call, with a rate limit hit for each request in it which was rejected.
+
+    request = http.request
+
+    def instrumented_request(uri, method="GET", body=None, *args, **kwargs):
+
+        start = time.time()
+        response, content = None, ""
+
+        try:
+            response, content = request(uri, method, body, *args, **kwargs)
+            return response, content
+        finally:
+            rate_limit_hits = 0
+            if response is not None and (response.status != 200 or "/batch" in uri):
+                rate_limit_hits = len(GOOGLE_RATE_LIMIT_REASON.findall(content))
+                if response.status == 429:
+                    rate_limit_hits = max(rate_limit_hits, 1)
+
+            metrics.record(service, get_request_method_name(method, uri), time.time() - start, get_body_size(body),
+                           len(content), rate_limit_hits, response is None or response.status >= 400)
+
+    http.request = instrumented_request
+    return http
+
+
+def instrument_mendeley_session(session, metrics):
+    # Records every request made through a MendeleySession, which includes each page of a listing
+
+    request = session.request
+
+    def instrumented_request(method, url, data=None, *args, **kwargs):
+
+        start = time.time()
+        rsp = None
+
+        try:
+            rsp = request(method, url, data, *args, **kwargs)
+            return rsp
+        except MendeleyApiException as e:
+            rsp = e.rsp
+            raise
+        finally:
+            received = 0 if rsp is None else len(rsp.content)
+            rate_limit_hits = 1 if rsp is not None and rsp.status_code == 429 else 0
+
+            metrics.record("mendeley", get_request_method_name(method, url), time.time() - start,
+                           get_body_size(data), received, rate_limit_hits, rsp is None or not rsp.ok)
+
+    session.request = instrumented_request
+    return session
@@ -0,0 +1,80 @@
+from xml.etree import cElementTree
+from cStringIO import StringIO
+from htmlentitydefs import name2codepoint
+import re
+
+# The XHTML entities ENML allows, other than the ones XML defines itself
+XHTML_ENTITY_PATTERN = re.compile(r"&(" + "|".join(name for name in name2codepoint
+                                                   if name not in ("amp", "lt", "gt", "quot", "apos")) + r");")
+
+
+class ParsedNote():
+    def __init__(self, body, location, description):
+        # The XML inside <en-note>, ready to be placed inside another note
+        self.body = body
+        # The text after "Location:" in the first top-level <div>, or "" if there isn't one
+        self.location = location
+        # The text of the last top-level element, used as the calendar event description
+        self.description = description
+
+
+def escape_text(text):
+    if text is None:
+        return ""
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+# Parses ENML note content in a single streaming pass. Each top-level element of the note
+# is serialised and discarded as soon as it is complete, so memory use doesn't grow with the size of the note.
+def parse_enml(content):
+
+    # ENML uses the XHTML entities, such as &nbsp; and &mdash;, which XML doesn't define and ENML parsers
+    # don't load the DTD for, so they are replaced with character references
+    if isinstance(content, unicode):
+        content = content.encode("utf-8")
+    content = XHTML_ENTITY_PATTERN.sub(lambda match: "&#" + str(name2codepoint[match.group(1)]) + ";", content)
+
+    body_parts = []
+    location = ""
+    description = None
+
+    depth = 0
+    root = None
+    previous_child = None
+    seen_first_div = False
+
+    for event, element in cElementTree.iterparse(StringIO(content), events=("start", "end")):
+
+        if event == "start":
+            depth += 1
+            if depth == 1:
+                root = element
+            elif depth == 2 and previous_child is None:
+                # The root's leading text is complete once its first child starts
+                body_parts.append(escape_text(root.text))
+            continue
+
+        depth -= 1
+        if depth != 1:
+            continue
+
+        # A top-level element has finished, but its tail isn't complete until the next one does
+        if previous_child is not None:
+            body_parts.append(cElementTree.tostring(previous_child))
+            root.remove(previous_child)
+
+        if element.tag == "div" and not seen_first_div:
+            seen_first_div = True
+            split_location = "".join(element.itertext()).split("Location:", 1)
+            if len(split_location) == 2:
+                location = split_location[1].replace(u"\xa0", " ").strip()
+
+        description = element.text
+        previous_child = element
+
+    if previous_child is not None:
+        body_parts.append(cElementTree.tostring(previous_child))
+    elif root is not None:
+        body_parts.append(escape_text(root.text))
+
+    return ParsedNote("".join(body_parts), location, description)
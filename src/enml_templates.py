@@ -0,0 +1,45 @@
+from xml.sax.saxutils import escape
+
+ENML_HEADER = "<?xml version=\"1.0\" encoding=\"UTF-8\"?><!DOCTYPE en-note SYSTEM \"http://xml.evernote.com/pub/enml2.dtd\">"
+
+# Evernote rejects titles longer than this
+MAX_TITLE_LENGTH = 255
+
+# The templates are ENML markup, and every value placed in them is escaped as text
+MENDELEY_NOTE_TEMPLATE = "Year = {year}, Source = {source}<br/><br/>Authors:<br/>{authors}"
+MENDELEY_AUTHOR_TEMPLATE = "{first} {second}<br/>"
+
+
+def render_enml(body):
+    return ENML_HEADER + "<en-note>" + body + "</en-note>"
+
+
+def escape_value(value):
+
+    if not isinstance(value, basestring):
+        value = str(value)
+
+    return escape(value)
+
+
+def render_note_title(title):
+    # Note titles are plain text rather than ENML, so they aren't escaped, but they can't contain
+    # line breaks, start or end with whitespace or be empty
+
+    title = " ".join(title.split())[:MAX_TITLE_LENGTH].strip()
+
+    if title == "":
+        return "Untitled"
+
+    return title
+
+
+def render_mendeley_note_content(doc):
+
+    authors = "".join(MENDELEY_AUTHOR_TEMPLATE.format(first=escape_value(author["first"]),
+                                                      second=escape_value(author["second"]))
+                      for author in doc["authors"])
+
+    return render_enml(MENDELEY_NOTE_TEMPLATE.format(year=escape_value(doc["year"]),
+                                                     source=escape_value(doc["source"]),
+                                                     authors=authors))
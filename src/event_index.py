@@ -0,0 +1,26 @@
+import sqlite3
+
+
+class CalendarEventIndex():
+    # Maps the guid of each event note to the Google Calendar event created from it,
+    # along with a hash of the event details last written to the calendar
+
+    def __init__(self, index_location):
+        self.connection = sqlite3.connect(index_location)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS calendar_events (note_guid TEXT PRIMARY KEY, "
+                                "calendar_event_id TEXT NOT NULL, content_hash TEXT NOT NULL)")
+        self.connection.commit()
+
+    def get(self, note_guid):
+        # Returns (calendar event id, content hash), or None if the note has never been synced
+
+        return self.connection.execute("SELECT calendar_event_id, content_hash FROM calendar_events WHERE note_guid = ?",
+                                       (note_guid,)).fetchone()
+
+    def contains(self, note_guid):
+        return self.get(note_guid) is not None
+
+    def put(self, note_guid, calendar_event_id, content_hash):
+        self.connection.execute("INSERT OR REPLACE INTO calendar_events (note_guid, calendar_event_id, content_hash) "
+                                "VALUES (?, ?, ?)", (note_guid, calendar_event_id, content_hash))
+        self.connection.commit()
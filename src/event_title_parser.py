@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+import re
+
+# Event note titles are of the form "yyyy-mm-dd HHMM-HHMM Event Name". The times may also be written HH:MM,
+# left out for an all day event, and an end date may follow the start date for an event spanning several days:
+#   "2000-10-01 1600-1700 Meeting", "2000-10-01 16:00-17:30 Meeting", "2000-10-01 Holiday",
+#   "2000-10-01 - 2000-10-03 Conference", "2000-10-01 - 2000-10-03 0900-1700 Conference"
+# Without a time range, a name starting with something like a time, e.g. "2000-10-01 1600-17 Meeting", is a
+# mistyped time range rather than an all day event, so the title is rejected. After a time range it is just the name.
+EVENT_TITLE_PATTERN = re.compile(r"""
+    (?P<start_year>\d{4})-(?P<start_month>\d{2})-(?P<start_day>\d{2})
+    (?:\s*-\s*(?P<end_year>\d{4})-(?P<end_month>\d{2})-(?P<end_day>\d{2}))?
+    (?:\s+(?P<start_hour>\d{2}):?(?P<start_minute>\d{2})-(?P<end_hour>\d{2}):?(?P<end_minute>\d{2})
+       |(?=\s+(?!(?:\d{3,4}|\d{1,2}:\d{2})\b)))
+    \s+(?P<name>\S.*)
+    \Z""", re.VERBOSE | re.DOTALL)
+
+
+class ParsedEventTitle():
+    def __init__(self, name, date, start_time, end_time, all_day):
+        self.name = name
+        # Midnight at the start of the first day of the event
+        self.date = date
+        # For all day events these are midnight on the first day and midnight after the last day
+        self.start_time = start_time
+        self.end_time = end_time
+        self.all_day = all_day
+
+
+# Validates and extracts the event details in one pass, returning None if the title isn't a valid event title
+def parse_event_title(title):
+
+    match = EVENT_TITLE_PATTERN.match(title)
+    if match is None:
+        return None
+
+    fields = match.groupdict()
+
+    try:
+        date = datetime(int(fields["start_year"]), int(fields["start_month"]), int(fields["start_day"]))
+
+        if fields["end_year"] is None:
+            end_date = date
+        else:
+            end_date = datetime(int(fields["end_year"]), int(fields["end_month"]), int(fields["end_day"]))
+            if end_date < date:
+                return None
+
+        if fields["start_hour"] is None:
+            return ParsedEventTitle(fields["name"], date, date, end_date + timedelta(days=1), True)
+
+        start_time = date.replace(hour=int(fields["start_hour"]), minute=int(fields["start_minute"]))
+        end_time = end_date.replace(hour=int(fields["end_hour"]), minute=int(fields["end_minute"]))
+
+    except ValueError:
+        # the numbers were the right shape but not a real date or time, e.g. 2000-02-30 or 2500
+        return None
+
+    return ParsedEventTitle(fields["name"], date, start_time, end_time, False)
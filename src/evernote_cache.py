@@ -0,0 +1,146 @@
+from evernote.edam.type.ttypes import Note, Tag
+
+import threading
+import sqlite3
+
+# Number of rows read from SQLite at a time when iterating over notes
+FIND_NOTES_BATCH_SIZE = 100
+
+
+class EvernoteMetadataCache():
+    # On-disk copy of the account's notebooks, tags and note metadata.
+    # The cache is only as current as the update count it was last synced to, which the
+    # EvernoteSyncEngine keeps up to date and resets when Evernote asks for a full sync.
+    # The cache is shared by jobs running on different threads, so every use of the connection holds the lock.
+
+    def __init__(self, cache_location):
+        self.connection = sqlite3.connect(cache_location, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.create_tables()
+
+    def create_tables(self):
+        with self.lock:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS sync_state (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+                CREATE TABLE IF NOT EXISTS notebooks (guid TEXT PRIMARY KEY, name TEXT NOT NULL, usn INTEGER);
+                CREATE INDEX IF NOT EXISTS notebooks_by_name ON notebooks (name);
+                CREATE TABLE IF NOT EXISTS tags (guid TEXT PRIMARY KEY, name TEXT NOT NULL, parent_guid TEXT, usn INTEGER);
+                CREATE INDEX IF NOT EXISTS tags_by_name ON tags (name);
+                CREATE TABLE IF NOT EXISTS notes (guid TEXT PRIMARY KEY, title TEXT, notebook_guid TEXT, created INTEGER,
+                                                  updated INTEGER, usn INTEGER, active INTEGER);
+                CREATE INDEX IF NOT EXISTS notes_by_notebook ON notes (notebook_guid, created);
+                CREATE INDEX IF NOT EXISTS notes_by_usn ON notes (usn);
+            """)
+            self.connection.commit()
+
+    def get_value(self, name, default=0):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM sync_state WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return default
+            return row[0]
+
+    def set_value(self, name, value):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO sync_state (name, value) VALUES (?, ?)", (name, value))
+
+    def get_update_count(self):
+        return self.get_value("update_count")
+
+    def is_synced(self):
+        return self.get_update_count() > 0
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM sync_state")
+            self.connection.execute("DELETE FROM notebooks")
+            self.connection.execute("DELETE FROM tags")
+            self.connection.execute("DELETE FROM notes")
+
+    def commit(self):
+        with self.lock:
+            self.connection.commit()
+
+    def put_notebook(self, notebook):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO notebooks (guid, name, usn) VALUES (?, ?, ?)",
+                                    (notebook.guid, notebook.name, notebook.updateSequenceNum))
+
+    def put_tag(self, tag):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO tags (guid, name, parent_guid, usn) VALUES (?, ?, ?, ?)",
+                                    (tag.guid, tag.name, tag.parentGuid, tag.updateSequenceNum))
+
+    def put_note(self, note):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO notes (guid, title, notebook_guid, created, updated, usn, active) "
+                                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    (note.guid, note.title, note.notebookGuid, note.created, note.updated,
+                                     note.updateSequenceNum, note.active))
+
+    def expunge_notebook(self, notebook_guid):
+        with self.lock:
+            self.connection.execute("DELETE FROM notebooks WHERE guid = ?", (notebook_guid,))
+
+    def expunge_tag(self, tag_guid):
+        with self.lock:
+            self.connection.execute("DELETE FROM tags WHERE guid = ?", (tag_guid,))
+
+    def expunge_note(self, note_guid):
+        with self.lock:
+            self.connection.execute("DELETE FROM notes WHERE guid = ?", (note_guid,))
+
+    def get_notebook_guid(self, notebook_name):
+        with self.lock:
+            row = self.connection.execute("SELECT guid FROM notebooks WHERE name = ?", (notebook_name,)).fetchone()
+            if row is None:
+                return None
+            return row[0]
+
+    def get_notebook_name(self, notebook_guid):
+        with self.lock:
+            row = self.connection.execute("SELECT name FROM notebooks WHERE guid = ?", (notebook_guid,)).fetchone()
+            if row is None:
+                return None
+            return row[0]
+
+    def get_tags(self):
+        with self.lock:
+            return [Tag(guid=guid, name=name, parentGuid=parent_guid, updateSequenceNum=usn)
+                    for guid, name, parent_guid, usn
+                    in self.connection.execute("SELECT guid, name, parent_guid, usn FROM tags")]
+
+    def get_note(self, note_guid):
+        # Returns the note's metadata, or None if it isn't an active note
+
+        for note in self.find_notes("guid = ?", (note_guid,)):
+            return note
+        return None
+
+    def find_notes(self, where_clause, parameters):
+        # Yields the active notes matching the where clause, oldest first, reading a batch of rows at a time.
+        # Each batch is a separate query, as other threads committing to the connection would reset an open cursor.
+
+        last_created = None
+        last_guid = None
+        while True:
+
+            query = "SELECT guid, title, notebook_guid, created, updated, usn FROM notes WHERE active AND (" + where_clause + ")"
+            query_parameters = list(parameters)
+            if last_guid is not None:
+                query += " AND (created > ? OR (created = ? AND guid > ?))"
+                query_parameters += [last_created, last_created, last_guid]
+            query += " ORDER BY created, guid LIMIT ?"
+            query_parameters.append(FIND_NOTES_BATCH_SIZE)
+
+            with self.lock:
+                batch = self.connection.execute(query, query_parameters).fetchall()
+
+            for guid, title, notebook_guid, created, updated, usn in batch:
+                yield Note(guid=guid, title=title, notebookGuid=notebook_guid, created=created, updated=updated,
+                           updateSequenceNum=usn, active=True)
+
+            if len(batch) < FIND_NOTES_BATCH_SIZE:
+                break
+            last_guid = batch[-1][0]
+            last_created = batch[-1][3]
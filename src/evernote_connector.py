@@ -1,12 +1,47 @@
-from evernote.api.client import EvernoteClient
+from evernote.api.client import EvernoteClient, Store
 from evernote.edam.notestore import NoteStore
-from evernote.edam.notestore.ttypes import NoteFilter
+from evernote.edam.notestore.ttypes import NoteFilter, NotesMetadataResultSpec
 from evernote.edam.type.ttypes import NoteSortOrder, Note, Tag
 from evernote.edam.error.ttypes import EDAMUserException, EDAMSystemException, EDAMNotFoundException
-
+from thrift.transport.TTransport import TTransportException
+from xml.etree.cElementTree import ParseError
+
+from enml_parser import parse_enml
+from enml_templates import render_enml, render_note_title, render_mendeley_note_content
+from event_title_parser import parse_event_title
+from rate_limiter import AdaptiveRateLimiter, ThrottledNoteStore
+from api_metrics import api_metrics, InstrumentedNoteStore, propagate_job
+
+from multiprocessing.pool import ThreadPool
+from itertools import islice, izip
+from collections import OrderedDict, namedtuple
 from datetime import datetime, timedelta
-from time import sleep
+import threading
+import calendar
 import logging
+import hashlib
+import socket
+import time
+
+GOAL_NOTEBOOKS = ["Backlog","Current","Complete","Dropped"]
+
+# Maximum number of notes fetched from Evernote at the same time
+NOTE_FETCH_THREADS = 4
+
+# Number of guids read at a time by iter_full_notes, which bounds how many fetched notes are held in memory
+NOTE_FETCH_BATCH_SIZE = 50
+
+# Times to try creating a note which fails for reasons other than the note itself, and the seconds between tries
+NOTE_CREATE_ATTEMPTS = 3
+NOTE_CREATE_RETRY_DELAY = 5
+
+# Evernote rejects tag names longer than this
+MAX_TAG_NAME_LENGTH = 100
+
+# When the response to a createNote is lost, this many of the newest notes in the notebook are checked for the
+# note before creating it again, allowing for this many milliseconds difference between our clock and Evernote's
+CREATED_NOTE_LOOKUP_COUNT = 10
+CREATED_NOTE_CLOCK_SKEW = 5 * 60 * 1000
 
 def check_if_valid_evernote_time(time_string):
     try:
@@ -15,14 +50,48 @@ def check_if_valid_evernote_time(time_string):
         raise EvernoteConnectorException("The given last-successful-evernote-check-time was of an invalid format")
 
 
-class Event():
-    def __init__(self, title, date, start_time, end_time, content, location):
-        self.title = title
-        self.date = date
-        self.start_time = start_time
-        self.end_time = end_time
-        self.content = content
-        self.location = location
+# Converts a GMT time in Evernote format to milliseconds since the epoch, as used by note.created
+def convert_evernote_time_to_timestamp(time_string):
+    return calendar.timegm(datetime.strptime(time_string, '%Y%m%dT%H%M%S').timetuple()) * 1000
+
+
+# The tag name used for an author, e.g. "J. Smith", or "" for an author without a name. Evernote rejects tag names
+# containing commas, starting or ending with whitespace, or longer than MAX_TAG_NAME_LENGTH.
+def get_author_tag_name(author):
+
+    author_name = ""
+    if len(author["first"].strip()) > 0:
+        author_name = author["first"].strip()[0] + ". "
+    author_name = author_name + author["second"]
+
+    return " ".join(author_name.replace(",", " ").split())[:MAX_TAG_NAME_LENGTH].strip()
+
+
+class Event(namedtuple("Event", ["title", "date", "start_time", "end_time", "parsed_note", "location",
+                                 "note_guid", "description", "all_day"])):
+    # Immutable and without a per-instance __dict__, so a large backfill of events stays small in memory
+
+    __slots__ = ()
+
+    def __new__(cls, title, date, start_time, end_time, parsed_note, location, note_guid=None, description=None,
+                all_day=False):
+        return super(Event, cls).__new__(cls, title, date, start_time, end_time, parsed_note, location,
+                                         note_guid, description, all_day)
+
+    @property
+    def content(self):
+        # The note body is kept by reference from the parsed note rather than copied into every event
+        return self.parsed_note.body
+
+
+class NoteCreationResult():
+    def __init__(self, note, created_note=None, error=None, retryable=False):
+        self.note = note
+        # The note as created or updated by Evernote, with its guid, or None if it couldn't be written
+        self.created_note = created_note
+        self.error = error
+        # False when Evernote rejected the note itself, so creating it again would fail in the same way
+        self.retryable = retryable
 
 
 class EvernoteConnectorException(Exception):
@@ -31,29 +100,114 @@ class EvernoteConnectorException(Exception):
 
 
 class EvernoteConnector(EvernoteClient):
-    def __init__(self, token, sandbox):
+    def __init__(self, token, sandbox, metadata_cache=None, rate_limiter=None):
         super(EvernoteConnector, self).__init__(token=token, sandbox=sandbox)
         self.auth_token = token
+        self.metadata_cache = metadata_cache
+
+        if rate_limiter is None:
+            rate_limiter = AdaptiveRateLimiter()
+        self.rate_limiter = rate_limiter
+        self.thread_local = threading.local()
+        self.note_store_url = None
+
+    def get_note_store(self):
+        # Every NoteStore call made by the connector goes through the shared rate limiter, and is recorded
+        # in the API metrics, including the calls which are rejected for exceeding the rate limit.
+        # Thrift clients can't be shared between threads, so each thread gets its own store.
+
+        throttled_note_store = getattr(self.thread_local, "note_store", None)
+
+        if throttled_note_store is None:
+            throttled_note_store = ThrottledNoteStore(InstrumentedNoteStore(self.create_note_store(), api_metrics),
+                                                      self.rate_limiter)
+            self.thread_local.note_store = throttled_note_store
+
+        return throttled_note_store
+
+    def create_note_store(self):
+        # Overridden to run against a fake note store, see util/fake_services.py
+        return Store(self.token, NoteStore.Client, self.get_note_store_url())
+
+    def get_note_store_url(self):
+        # The note store URL doesn't change, so only ask the user store for it once per connector
 
-    def get_new_events(self, since):
+        if self.note_store_url is None:
+            self.note_store_url = self.get_user_store().getNoteStoreUrl()
 
+        return self.note_store_url
+
+    def get_full_note(self, note_guid):
+        return self.get_note_store().getNote(self.auth_token, note_guid, True, False, False, False)
+
+    def iter_full_notes(self, note_guids):
+        # Fetches the notes with their content in parallel, yielding them in the same order as the guids.
+        # The guids can be any iterable, and are read a batch at a time on the calling thread.
+
+        note_guids = iter(note_guids)
+
+        pool = ThreadPool(NOTE_FETCH_THREADS)
         try:
+            while True:
+                batch_guids = list(islice(note_guids, NOTE_FETCH_BATCH_SIZE))
+                if len(batch_guids) == 0:
+                    break
 
-            check_if_valid_evernote_time(since)
+                for full_note in pool.map(propagate_job(self.get_full_note), batch_guids):
+                    yield full_note
+        finally:
+            pool.close()
+            pool.join()
+
+    def get_notebook_guid(self, notebook_name):
+
+        # Use the local cache where possible, falling back to the network for notebooks created since the last sync
+        if self.metadata_cache is not None:
+            notebook_guid = self.metadata_cache.get_notebook_guid(notebook_name)
+            if notebook_guid is not None:
+                return notebook_guid
+
+        for notebook in self.get_note_store().listNotebooks():
+            if notebook.name == notebook_name:
+                return notebook.guid
 
-            new_event_note_filter = self.get_note_filter(since,"Events")
+        raise EvernoteConnectorException("Unable to find a notebook with the name '" + notebook_name + "'")
 
-            event_metadata_list = self.get_note_store().findNotesMetadata(self.auth_token, new_event_note_filter, 0, 50, NoteStore.NotesMetadataResultSpec())
-            # Assuming that I won't create more than 50 events between checks (at the time of writing, checks are once per day)
+    def get_tags(self):
 
-            events = []
-            for note_metadata in event_metadata_list.notes:
+        if self.metadata_cache is not None and self.metadata_cache.is_synced():
+            return self.metadata_cache.get_tags()
 
-                full_note = self.get_note_store().getNote(self.auth_token, note_metadata.guid, True, False, False, False)
+        return self.get_note_store().listTags()
 
-                events.append(self.convert_note_to_event(full_note))
+    def create_tag(self, tag):
 
-            return events
+        new_tag = self.get_note_store().createTag(tag)
+
+        if self.metadata_cache is not None:
+            self.metadata_cache.put_tag(new_tag)
+            self.metadata_cache.commit()
+
+        return new_tag
+
+    def get_new_events(self, since, sync_engine, event_index=None, note_metadata_list=None):
+        # Returns the events created since the given time, and any changed events which have already been synced,
+        # along with the notes whose titles couldn't be parsed.
+        # Only the given notes are considered if a list is passed, otherwise all event notes changed since the last run.
+
+        try:
+
+            check_if_valid_evernote_time(since)
+            since_timestamp = convert_evernote_time_to_timestamp(since)
+
+            if note_metadata_list is None:
+                note_metadata_list, update_count = sync_engine.get_changed_notes("events", ["Events"])
+
+            event_guids = (note_metadata.guid for note_metadata in note_metadata_list
+                           if note_metadata.created > since_timestamp
+                           or (event_index is not None and event_index.contains(note_metadata.guid)))
+
+            return self.convert_notes_to_events(self.iter_full_notes(event_guids))
 
         except (EDAMUserException, EDAMSystemException, EDAMNotFoundException) as e:
             # currently I am not managing what to do if the API call is bad
@@ -66,236 +220,288 @@ class EvernoteConnector(EvernoteClient):
 
     def convert_note_to_event(self, event_note):
 
-        self.check_if_valid_event_note(event_note)
-
-        split_title = event_note.title.split(" ", 2)
+        parsed_title = self.check_if_valid_event_note(event_note)
 
-        date_timestamp = datetime.strptime(split_title[0], '%Y-%m-%d')
-        start_string = split_title[1].split("-")[0]
-        end_string = split_title[1].split("-")[1]
+        parsed_note = parse_enml(event_note.content)
 
-        start_timestamp = datetime.strptime(split_title[0] + " " + start_string, '%Y-%m-%d %H%M')
-        end_timestamp = datetime.strptime(split_title[0] + " " + end_string, '%Y-%m-%d %H%M')
+        title = parsed_title.name.replace("&nbsp;"," ")
 
-        location = ""
+        return Event(title, parsed_title.date, parsed_title.start_time, parsed_title.end_time, parsed_note,
+                     parsed_note.location, event_note.guid, parsed_note.description, parsed_title.all_day)
 
-        split_location = event_note.content.split("<div>",1)
-        if len(split_location) == 2:
-            split_location = split_location[1].split("</div>",1)
-            if len(split_location) == 2:
-                split_location = split_location[0].split("Location:",1)
-                if len(split_location) == 2:
-                    location = split_location[1].strip()
+    def convert_notes_to_events(self, event_notes):
+        # Converts the notes in a single pass, returning the events and the notes which aren't valid events,
+        # so one badly titled or malformed note doesn't stop the rest being synced
 
-        location = location.replace("&nbsp;"," ")
-        title = split_title[2].replace("&nbsp;"," ")
+        events = []
+        invalid_notes = []
 
-        return Event(title, date_timestamp, start_timestamp, end_timestamp, event_note.content.replace('&nbsp;','&#160;'), location)
+        for event_note in event_notes:
+            try:
+                events.append(self.convert_note_to_event(event_note))
+            except (EvernoteConnectorException, ParseError):
+                invalid_notes.append(event_note)
 
-    def get_note_filter(self,start_time,notebook_name,end_time=None):
+        if len(invalid_notes) > 0:
+            logging.warning(str(len(invalid_notes)) + " event notes have titles or content which cannot be parsed for event details: "
+                            + ", ".join("'" + note.title + "'" for note in invalid_notes))
 
-        for notebook in self.get_note_store().listNotebooks():
-            if notebook.name == notebook_name:
-                event_notebook_guid = notebook.guid
-                break
+        return events, invalid_notes
 
-        if event_notebook_guid is None:
-            raise EvernoteConnectorException("Unable to find a notebook with the name '" + notebook_name + "'")
+    def check_if_valid_event_note(self,note):
+        # Returns the parsed title, see event_title_parser for the formats accepted
 
-        note_filter = NoteFilter()
-        note_filter.order = NoteSortOrder.CREATED
-        note_filter.ascending = True
-        note_filter.notebookGuid = event_notebook_guid
-        if end_time is None:
-            note_filter.words = "created:" + start_time + "Z"
-        else:
-            note_filter.words = "created:" + start_time + "Z -" + end_time
+        parsed_title = parse_event_title(note.title)
 
-        return note_filter
+        if parsed_title is None:
+            raise EvernoteConnectorException("The title of note '" + note.title + "' is invalid and cannot be parsed for event details")
 
-    def check_if_valid_event_note(self,note):
-        # we expect the title to be of the form "2000-10-01 1600-1700 Title Name..."
+        return parsed_title
 
-        try:
+    def process_goal_updates(self, goal_state_store, sync_engine, note_metadata_list=None):
 
-            split_title = note.title.split(" ", 2)
+        annotations = []
 
-            if len(split_title) != 3:
-                raise ValueError
+        # Only the goals which have changed since the last run can have moved notebook
+        if note_metadata_list is None:
+            note_metadata_list, update_count = sync_engine.get_changed_notes("goals", GOAL_NOTEBOOKS)
 
-            datetime.strptime(split_title[0], '%Y-%m-%d')
+        for note_metadata in note_metadata_list:
 
-            if len(split_title[1].split("-")) != 2:
-                raise ValueError
+            notebook_name = sync_engine.get_notebook_name(note_metadata.notebookGuid)
+            previous_notebook = goal_state_store.get_state(note_metadata.guid)
 
-            start_time = split_title[1].split("-")[0]
-            end_time = split_title[1].split("-")[1]
+            if previous_notebook == notebook_name:
+                # the goal is in the same state as it was the last time we checked
+                continue
 
-            datetime.strptime(start_time, '%H%M')
-            datetime.strptime(end_time, '%H%M')
+            if previous_notebook is not None:
+                # We know the note used to be in another notebook, so annotate the note and update what we know
 
-            if split_title[2] == "":
-                raise ValueError
+                annotation = (datetime.now()-timedelta(days=1)).strftime("%Y-%m-%d") \
+                                            + " Moved from " + previous_notebook \
+                                            + " to " + notebook_name
+                annotations.append((note_metadata.guid,annotation,False))
 
-        except ValueError:
-            raise EvernoteConnectorException("The title of note '" + note.title + "' is invalid and cannot be parsed for event details")
+            else:
+                # The note has been newly added
+                # So annotate the note and save the state of the note locally
 
-    def get_all_notes_metadata(self, auth_token, note_filter, metadata_spec):
+                annotation = (datetime.now()-timedelta(days=1)).strftime("%Y-%m-%d") \
+                                            + " Added to " + notebook_name
+                annotations.append((note_metadata.guid,annotation,True))
 
-        all_notes = []
-        start_index = 0
-        result_size = 50
+            goal_state_store.set_state(note_metadata.guid, notebook_name)
 
-        there_are_more_notes = True
-        while there_are_more_notes:
+        self.annotate_notes(annotations)
 
-            note_metadata_list = self.get_note_store().findNotesMetadata(auth_token,
-                                                                         note_filter, start_index, result_size,
-                                                                         metadata_spec)
-            all_notes = all_notes + note_metadata_list.notes
+        return goal_state_store
 
-            if note_metadata_list.totalNotes > start_index + result_size:
-                there_are_more_notes = True
-                start_index += result_size
-            else:
-                there_are_more_notes = False
 
-        return all_notes
+    def annotate_notes(self, annotations):
+        # Takes a list of (note guid, annotation, add line break). All the annotations for a note are applied
+        # in a single update, the notes are fetched concurrently, and notes which end up unchanged aren't written.
 
-    def process_goal_updates(self, stored_goal_states):
-        note_filter = NoteFilter()
+        annotations_by_guid = OrderedDict()
+        for note_guid, annotation, add_line_break in annotations:
+            annotations_by_guid.setdefault(note_guid, []).append((annotation, add_line_break))
 
-        # Get all the goals
-        for notebook in self.get_note_store().listNotebooks():
+        for full_note in self.iter_full_notes(annotations_by_guid.keys()):
 
-            if notebook.name not in ["Backlog","Current","Complete","Dropped"]:
-                continue
+            original_content = full_note.content
 
-            note_filter.notebookGuid = notebook.guid
+            for annotation, add_line_break in annotations_by_guid[full_note.guid]:
 
-            note_metadata_list = self.get_all_notes_metadata(self.auth_token,note_filter,NoteStore.NotesMetadataResultSpec())
+                if "<div>" + annotation + "</div>" in full_note.content:
+                    # e.g. a previous run annotated the note but failed before saving the goal states
+                    logging.debug("Goal \"" + full_note.title + "\" is already annotated with \"" + annotation + "\"")
+                    continue
 
-            # For each goal
-            for note_metadata in note_metadata_list:
+                logging.debug("Annotating goal \"" + full_note.title + "\" with \"" + annotation + "\"")
 
-                # Check if the goal is new or has changed state (moved from another notebook)
-                if note_metadata.guid in stored_goal_states[notebook.name]:
-                    # the goal is in the same state as it was the last time we checked
-                    continue
+                if add_line_break is True:
+                    line_break = "<br clear=\"none\"/>"
                 else:
-                    # the goal is new, or it has changed state
-                    # search to see if it was previously in a different notebook
-                    other_notebooks = ["Backlog","Current","Complete","Dropped"]
-                    other_notebooks.remove(notebook.name)
+                    line_break = ""
 
-                    goal_has_moved = None
+                full_note.content = full_note.content.replace("</en-note>", line_break + "<div>" + annotation
+                                                              + "</div></en-note>")
 
-                    for previous_notebook in other_notebooks:
-                        if note_metadata.guid in stored_goal_states[previous_notebook]:
-                            # We know the note used to be in this notebook, so annotate the note and update what we know
+            if full_note.content != original_content:
+                self.get_note_store().updateNote(full_note)
 
-                            annotation = (datetime.now()-timedelta(days=1)).strftime("%Y-%m-%d") \
-                                                        + " Moved from " + previous_notebook \
-                                                        + " to " + notebook.name
-                            self.annotate_note(note_metadata.guid,annotation,False)
+    def concatenate_notes(self, full_notes):
+        # A note whose content can't be parsed is left out, rather than stopping the whole summary
 
-                            stored_goal_states[previous_notebook].remove(note_metadata.guid)
-                            stored_goal_states[notebook.name].append(note_metadata.guid)
+        bodies = []
+        for full_note in full_notes:
+            try:
+                bodies.append(parse_enml(full_note.content).body)
+            except ParseError as e:
+                logging.error("Leaving out the daily log '" + full_note.title + "' as its content can't be parsed: " + str(e))
 
-                            goal_has_moved = True
-                            break
+        logging.debug("Summarised " + str(len(bodies)) + " daily logs")
 
-                    if goal_has_moved is None:
-                        # The note has been newly added
-                        # So annotate the note and save the state of the note locally
+        return render_enml("".join(bodies))
 
-                        annotation = (datetime.now()-timedelta(days=1)).strftime("%Y-%m-%d") \
-                                                        + " Added to " + notebook.name
-                        self.annotate_note(note_metadata.guid,annotation,True)
+    def iter_concatenated_notes(self, note_guid_groups):
+        # Yields the concatenated content of each group of notes in turn. The notes of every group
+        # are fetched through the same pool, so later groups are downloading while earlier ones are used.
 
-                        stored_goal_states[notebook.name].append(note_metadata.guid)
+        note_guid_groups = list(note_guid_groups)
+        full_notes = self.iter_full_notes(note_guid for note_guids in note_guid_groups for note_guid in note_guids)
 
-        return stored_goal_states
+        for note_guids in note_guid_groups:
+            yield self.concatenate_notes(islice(full_notes, len(note_guids)))
 
+    def sync_summary_logs(self, notebook_name, summaries, summary_index, sync_engine):
+        # Writes a summary note for each (title, daily log metadata list) from the concatenated daily logs.
+        # A week whose daily logs haven't changed since its summary was written is left alone, and a week whose
+        # summary already exists is updated in place, so running this again never creates duplicates.
+        # Returns a NoteCreationResult for each note written.
 
-    def annotate_note(self, note_guid, annotation, add_line_break):
+        try:
 
-        full_note = self.get_note_store().getNote(self.auth_token, note_guid, True, False, False, False)
+            existing_summary_guids = dict((note_metadata.title, note_metadata.guid)
+                                          for note_metadata in sync_engine.get_notes_in_notebook(notebook_name))
 
-        logging.debug("Annotating goal \"" + full_note.title + "\" with \"" + annotation + "\"")
+            pending_summaries = []
+            for title, note_metadata_list in summaries:
 
-        if add_line_break is True:
-            line_break = "<br clear=\"none\"/>"
-        else:
-            line_break = ""
+                daily_logs = [(note_metadata.guid, note_metadata.updateSequenceNum) for note_metadata in note_metadata_list]
+                indexed_summary = summary_index.get(title)
 
-        full_note.content = full_note.content.replace("</en-note>", line_break + "<div>" + annotation
-                                                      + "</div></en-note>")
+                if indexed_summary is None and title in existing_summary_guids:
+                    # Written before the index existed, so taken to be up to date with the daily logs as they are now
+                    summary_index.put(title, existing_summary_guids[title], daily_logs, None)
+                elif indexed_summary is None and len(daily_logs) > 0:
+                    pending_summaries.append((title, daily_logs, None, None))
+                elif indexed_summary is not None and indexed_summary[1] != daily_logs:
+                    pending_summaries.append((title, daily_logs, indexed_summary[0], indexed_summary[2]))
 
-        self.get_note_store().updateNote(full_note)
+            if len(pending_summaries) == 0:
+                logging.debug("No daily logs have changed since their summaries were written")
+                return []
 
-    def create_summary_log(self,notebook_name,title,content):
+            notebook_guid = self.get_notebook_guid(notebook_name)
+            contents = self.iter_concatenated_notes([note_guid for note_guid, usn in daily_logs]
+                                                    for title, daily_logs, summary_guid, content_hash in pending_summaries)
 
-        new_note = Note()
-        new_note.title = title
-        new_note.content = content
+            results = []
+            for (title, daily_logs, summary_guid, content_hash), content in izip(pending_summaries, contents):
 
-        notebook_guid = None
-        for notebook in self.get_note_store().listNotebooks():
-            if notebook.name == notebook_name:
-                notebook_guid = notebook.guid
-                break
+                if isinstance(content, unicode):
+                    content = content.encode("utf-8")
+                new_content_hash = hashlib.sha1(content).hexdigest()
 
-        if notebook_guid is None:
-            raise EvernoteConnectorException("Cannot find notebook called " + notebook_name)
+                if new_content_hash == content_hash:
+                    # e.g. only a daily log's tags changed
+                    summary_index.put(title, summary_guid, daily_logs, content_hash)
+                    continue
 
-        new_note.notebookGuid = notebook_guid
+                summary_note = Note(title=title, content=content, notebookGuid=notebook_guid)
 
-        try:
-            note = self.get_note_store().createNote(self.auth_token, new_note)
+                if summary_guid is None:
+                    result = self.create_note_with_retries(summary_note)
+                else:
+                    summary_note.guid = summary_guid
+                    result = self.write_note_with_retries(summary_note, "updateNote")
+
+                    if isinstance(result.error, EDAMNotFoundException):
+                        # The summary has been deleted since it was written
+                        summary_note.guid = None
+                        result = self.create_note_with_retries(summary_note)
 
-        except (EDAMUserException, EDAMNotFoundException) as e:
+                if result.error is None:
+                    summary_index.put(title, result.created_note.guid, daily_logs, new_content_hash)
+                results.append(result)
+
+            return results
+
+        except (EDAMUserException, EDAMSystemException, EDAMNotFoundException) as e:
             raise EvernoteConnectorException(e)
 
+    def create_notes(self, notes):
+        # Returns a NoteCreationResult for each note, in the same order
+        return list(self.iter_created_notes(notes))
 
-    def get_concatenated_daily_logs(self, start_time, end_time):
+    def iter_created_notes(self, notes):
+        # Creates the notes one at a time through the shared rate limiter, yielding each result as soon as it is known.
+        # A note which fails is retried on its own and then reported in its result, so it never stops the others.
 
-        try:
+        for note in notes:
+            yield self.create_note_with_retries(note)
 
-            check_if_valid_evernote_time(start_time)
-            check_if_valid_evernote_time(end_time)
+    def create_note_with_retries(self, note):
+        return self.write_note_with_retries(note, "createNote")
 
-            new_event_note_filter = self.get_note_filter(start_time,"Daily",end_time)
+    def write_note_with_retries(self, note, method_name):
+        # method_name is the NoteStore method to write the note with, createNote or updateNote.
+        # Updating a note again is harmless, but a create whose response was lost may have been written, so
+        # the notebook is checked for the note before it is created again, rather than creating a duplicate.
 
-            note_metadata_list = self.get_note_store().findNotesMetadata(self.auth_token, new_event_note_filter, 0, 10, NoteStore.NotesMetadataResultSpec())
+        attempts = 0
+        first_write_time = None
+        may_have_been_created = False
+        while True:
+            attempts += 1
+            try:
+                if may_have_been_created:
+                    created_note = self.find_created_note(note, first_write_time - CREATED_NOTE_CLOCK_SKEW)
+                    if created_note is not None:
+                        logging.info("Note '" + note.title + "' was created by an attempt whose response was lost")
+                        return NoteCreationResult(note, created_note=created_note)
 
-            logging.debug("Found " + str(len(note_metadata_list.notes)) + " daily logs to summarise")
+                if first_write_time is None:
+                    first_write_time = int(time.time() * 1000)
 
-            concatenated_logs = "<?xml version=\"1.0\" encoding=\"UTF-8\"?><!DOCTYPE en-note SYSTEM \"http://xml.evernote.com/pub/enml2.dtd\"><en-note>"
-            for note_metadata in note_metadata_list.notes:
+                # Rate limit errors are waited out and retried by the throttled note store
+                write_note = getattr(self.get_note_store(), method_name)
+                return NoteCreationResult(note, created_note=write_note(self.auth_token, note))
 
-                full_note = self.get_note_store().getNote(self.auth_token, note_metadata.guid, True, False, False, False)
+            except (EDAMUserException, EDAMNotFoundException) as e:
+                # The note itself was rejected, so trying again won't help
+                return NoteCreationResult(note, error=e, retryable=False)
 
-                split_content = full_note.content.split("<en-note>")
+            except (EDAMSystemException, TTransportException, socket.error) as e:
+                # Evernote reports system errors before writing anything, but a connection can fail after
+                if method_name == "createNote" and first_write_time is not None \
+                        and isinstance(e, (TTransportException, socket.error)):
+                    may_have_been_created = True
 
-                if len(split_content) != 2:
-                    split_content = full_note.content.split(";\">",1)
+                if attempts == NOTE_CREATE_ATTEMPTS:
+                    return NoteCreationResult(note, error=e, retryable=True)
 
-                split_content = split_content[1].split("</en-note>")
+                logging.warning("Failed to write note '" + note.title + "', retrying: " + str(e))
+                time.sleep(NOTE_CREATE_RETRY_DELAY * attempts)
 
-                concatenated_logs = concatenated_logs + split_content[0]
+    def find_created_note(self, note, since_timestamp):
+        # Returns the metadata of a note in the note's notebook with the same title, created since the timestamp
 
-            return concatenated_logs + "</en-note>"
+        note_filter = NoteFilter(notebookGuid=note.notebookGuid, order=NoteSortOrder.CREATED, ascending=False)
+        result_spec = NotesMetadataResultSpec(includeTitle=True, includeCreated=True)
 
-        except (EDAMUserException, EDAMSystemException, EDAMNotFoundException) as e:
-            # currently I am not managing what to do if the API call is bad
-            # I will need to consider things like rate limiting and token expiry
-            raise EvernoteConnectorException(e)
+        title = note.title.encode("utf-8") if isinstance(note.title, unicode) else note.title
+
+        note_metadata_list = self.get_note_store().findNotesMetadata(self.auth_token, note_filter, 0,
+                                                                     CREATED_NOTE_LOOKUP_COUNT, result_spec)
+        for note_metadata in note_metadata_list.notes:
+            note_metadata_title = note_metadata.title
+            if isinstance(note_metadata_title, unicode):
+                note_metadata_title = note_metadata_title.encode("utf-8")
 
-    def add_new_mendeley_docs(self,docs):
+            if note_metadata_title == title and note_metadata.created >= since_timestamp:
+                return note_metadata
+
+        return None
+
+    def add_new_mendeley_docs(self, docs, doc_added=None):
+        # The docs can be any iterable, e.g. a generator still being fed from Mendeley.
+        # doc_added is called with each document once it has been dealt with, so the import can be resumed after it.
+        # Returns the documents which Evernote rejected, and raises if a note couldn't be created for any other reason.
 
         notebook_name = "Literature"
-        all_tags = self.get_note_store().listTags()
+        all_tags = self.get_tags()
 
         authors_group_guid = None
         for tag in all_tags:
@@ -303,90 +509,74 @@ class EvernoteConnector(EvernoteClient):
                 authors_group_guid = tag.guid
 
         if authors_group_guid is None:
-            logging.critical("Can't find 'Authors' tag")
-            exit(1)
+            raise EvernoteConnectorException("Can't find 'Authors' tag")
 
-        total_num_docs = len(docs)
-        processed_counter = -1
+        # Lower-cased author tag name to tag guid, so creating each note needs no further lookups
+        author_tag_guids = dict((tag.name.lower(), tag.guid) for tag in all_tags)
+        notebook_guid = self.get_notebook_guid(notebook_name)
+
+        rejected_docs = []
+        processed_counter = 0
         for doc in docs:
 
             processed_counter += 1
-            logging.debug("Adding Mendeley document " + str(processed_counter) + "/" + str(total_num_docs) + " to evernote.")
 
-            attempts = 0
-            while True:
+            try:
+                self.resolve_author_tags(doc, author_tag_guids, authors_group_guid)
+                result = self.create_note_with_retries(
+                    self.convert_mendeley_doc_to_note(doc, notebook_guid, author_tag_guids))
+            except EDAMUserException as e:
+                # An author's tag was rejected, which would happen again on every run, so the document is passed over
+                result = NoteCreationResult(None, error=e, retryable=False)
+
+            if result.error is None:
+                logging.debug("Added Mendeley document " + str(processed_counter) + " to evernote.")
+            elif result.retryable:
+                # Stop here, so that the next run carries on from this document
+                raise EvernoteConnectorException("Failed to add Mendeley document '" + doc["title"] + "' to evernote: "
+                                                 + str(result.error))
+            else:
+                logging.critical("Evernote rejected Mendeley document '" + doc["title"] + "': " + str(result.error))
+                rejected_docs.append(doc)
 
-                all_tags = self.get_note_store().listTags()
-                try:
-                    new_note = Note()
-                    new_note.title = doc["title"].replace("&","&amp;");
-                    
-                    notebook_guid = None
-                    for notebook in self.get_note_store().listNotebooks():
-                        if notebook.name == notebook_name:
-                            notebook_guid = notebook.guid
-                            break
-
-                    if notebook_guid is None:
-                        raise EvernoteConnectorException("Cannot find notebook called " + notebook_name)
-
-                    new_note.notebookGuid = notebook_guid
-
-                    authors_concatenated = ""
-                    tag_guids_to_add_to_note = []
-
-                    newly_created_authors = {}
-                    for author in doc["authors"]:
-                    
-                        author_name = ""
-                        if len(author["first"]) > 0:        
-                            author_name = author["first"][0] + ". "
-                        if len(author["second"]) > 0:
-                            author_name = author_name + author["second"]
-
-                        authors_concatenated = authors_concatenated + author["first"] + " " + author["second"] + "<br/>"
-
-                        author_tag_guid = None
-
-                        # try to find the author tag if it already exists
-                        for tag in all_tags:
-                            if tag.name.lower() == author_name.lower():
-                                author_tag_guid = tag.guid
-                                break
-                        
-                        # (this is necessary in case the author is repeated in the paper)
-                        if author_name in newly_created_authors:
-                            author_tag_guid = newly_created_authors[author_name]
-
-                        # otherwise, create it
-                        if author_tag_guid is None:
-                            logging.debug("Creating tag for " + author_name)
-                            new_tag = Tag()
-                            new_tag.name = author_name
-                            new_tag.parentGuid = authors_group_guid
-                            author_tag_guid = self.get_note_store().createTag(new_tag).guid
-                            newly_created_authors[author_name] = author_tag_guid
-
-                        tag_guids_to_add_to_note.append(author_tag_guid)
-
-                    new_note.tagGuids = tag_guids_to_add_to_note
-                    
-                    content = "<?xml version=\"1.0\" encoding=\"UTF-8\"?><!DOCTYPE en-note SYSTEM \"http://xml.evernote.com/pub/enml2.dtd\"><en-note>Year = " + str(doc["year"]) + ", Source = " + str(doc["source"]) + "<br/><br/>Authors:<br/>" + authors_concatenated + "</en-note>"
-
-                    new_note.content = content.replace("&","&amp;");
-
-                    note = self.get_note_store().createNote(self.auth_token, new_note)
-                    sleep(5)
-                    break
+            if doc_added is not None:
+                doc_added(doc)
+
+        return rejected_docs
+
+    def convert_mendeley_doc_to_note(self, doc, notebook_guid, author_tag_guids):
+
+        new_note = Note()
+        new_note.title = render_note_title(doc["title"])
+        new_note.notebookGuid = notebook_guid
+        new_note.tagGuids = []
+        for author in doc["authors"]:
+            author_tag_guid = author_tag_guids.get(get_author_tag_name(author).lower())
+            if author_tag_guid is not None and author_tag_guid not in new_note.tagGuids:
+                new_note.tagGuids.append(author_tag_guid)
+        new_note.content = render_mendeley_note_content(doc)
+
+        return new_note
+
+    def resolve_author_tags(self, doc, author_tag_guids, authors_group_guid):
+        # Adds the doc's authors to the map of lower-cased author tag name to tag guid, creating the tags which
+        # don't exist yet. The map is shared across the import, so each author's tag is only looked up or created once.
+        # Authors without a name aren't tagged. Raises EDAMUserException if Evernote rejects a tag.
+
+        for author in doc["authors"]:
+
+            author_name = get_author_tag_name(author)
+            if author_name == "" or author_name.lower() in author_tag_guids:
+                continue
+
+            try:
+                logging.debug("Creating tag for " + author_name)
+                new_tag = Tag()
+                new_tag.name = author_name
+                new_tag.parentGuid = authors_group_guid
+                author_tag_guids[author_name.lower()] = self.create_tag(new_tag).guid
 
-                except (EDAMUserException, EDAMNotFoundException) as e:
-                    raise EvernoteConnectorException(e)
-                except (EDAMSystemException) as ex:
-                    if(attempts == 5):
-                        logging.critical("Tried to insert note 5 times, but keep getting exception: " + str(ex))
-                        exit(1)
-                    else:
-                        attempts += 1
-                        logging.info("Attempt " + str(attempts) + " has returned rate limit error, waiting for " + str(ex.rateLimitDuration) + " seconds")
-                        sleep(ex.rateLimitDuration + 1)
+            except (EDAMNotFoundException, EDAMSystemException) as e:
+                raise EvernoteConnectorException(e)
 
+        return author_tag_guids
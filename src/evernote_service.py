@@ -1,15 +1,46 @@
 from config import settings
 
-from evernote_connector import EvernoteConnector, EvernoteConnectorException
+from evernote_connector import EvernoteConnector, EvernoteConnectorException, GOAL_NOTEBOOKS, \
+    convert_evernote_time_to_timestamp
+from evernote_sync import EvernoteSyncEngine
+from evernote_cache import EvernoteMetadataCache
+from rate_limiter import AdaptiveRateLimiter
+from event_index import CalendarEventIndex
+from goal_state_store import GoalStateStore
+from summary_index import WeeklySummaryIndex
+from webhook_receiver import WebhookReceiver
 from gcalender_connector import GoogleCalendarConnector
 from mendeley_connector import MendeleyConnector
+from thrift.transport.TTransport import TTransportException
+from api_metrics import api_metrics, tag_job, propagate_job
 import schedule
 import time
 
+from multiprocessing.pool import ThreadPool
+from multiprocessing import TimeoutError
+from Queue import Queue, Full
+from itertools import chain
+from bisect import bisect_right
 from datetime import datetime, timedelta
-from os import path
+from os import path, rename, remove
+import threading
 import logging
+import socket
 import json
+import sys
+
+# Shared by every EvernoteConnector so that all jobs draw on the same rate limit budget
+evernote_rate_limiter = AdaptiveRateLimiter()
+
+# Number of Mendeley documents which can be waiting to be added to Evernote
+MENDELEY_QUEUE_SIZE = 100
+
+connector_pool = {}
+connector_pool_lock = threading.Lock()
+
+# The update count the last poll ran the jobs at. Changes a job leaves unprocessed, such as event notes
+# with invalid titles, keep its cursor behind, so the jobs are only run again once something else changes.
+last_poll = {"update_count": None}
 
 # Returns timestamp in GMT according to settings.GMT_OFFSET
 def get_last_successful_check_time(latest_check_time_location):
@@ -69,150 +100,494 @@ def get_end_of_week(at_timestamp):
     return corrected_timestamp.strftime("%Y%m%dT%H%M%S")
 
 
-def process_events():
+# Creating a connector means authenticating (and for Google, building the service from its discovery document),
+# so each connector is created the first time a job needs it and then reused for the life of the process
+def get_pooled_connector(name, create_connector):
+    with connector_pool_lock:
+        if name not in connector_pool:
+            logging.debug("Creating " + name + " connector")
+            connector_pool[name] = create_connector()
+        return connector_pool[name]
+
+
+def create_evernote_connector():
+
+    metadata_cache = EvernoteMetadataCache(settings.EVERNOTE_CACHE_LOCATION)
+    evernote_client = EvernoteConnector(token=settings.EVERNOTE_AUTH_TOKEN,sandbox=settings.EVERNOTE_SANDBOX_MODE,
+                                        metadata_cache=metadata_cache, rate_limiter=evernote_rate_limiter)
+
+    return evernote_client, EvernoteSyncEngine(evernote_client, metadata_cache)
+
+
+@tag_job("sync")
+def get_synced_evernote_client():
+
+    evernote_client, sync_engine = get_pooled_connector("evernote", create_evernote_connector)
+
+    # A single getSyncState call is made when nothing has changed since the last sync
+    sync_engine.sync()
+
+    return evernote_client, sync_engine
+
+
+def get_google_client():
+    return get_pooled_connector("google",
+                                lambda: GoogleCalendarConnector(credentials_file=settings.GOOGLE_CREDENTIALS_FILE))
+
+
+def get_mendeley_client():
+    # The access token is refreshed by the connector when it is next used, if it has expired
+    return get_pooled_connector("mendeley", lambda: MendeleyConnector(settings.MENDELEY_CREDENTIALS_FILE))
+
+# When note_metadata_list is given only those notes are processed, e.g. for a webhook notification,
+# and the check time and cursor are left alone so the next full run still sees every other change
+@tag_job("events")
+def process_events(evernote_client, sync_engine, note_metadata_list=None):
 
     current_check_time = None
 
     # Get new events from Evernote
     logging.info("Getting new events from Evernote")
-    evernote_client = EvernoteConnector(token=settings.EVERNOTE_AUTH_TOKEN,sandbox=settings.EVERNOTE_SANDBOX_MODE)
     try:
         current_check_time = datetime.now().strftime("%Y%m%dT%H%M%S")
         last_successful_check_time = get_last_successful_check_time(settings.LATEST_EVERNOTE_CHECK_TIME_LOCATION)
 
         logging.debug("Last successful check was " + last_successful_check_time)
 
-        events = evernote_client.get_new_events(since=last_successful_check_time)
+        # The cursor is committed as the update count the changed notes were read at,
+        # so changes synced by other jobs in the meantime aren't skipped
+        changed_notes = note_metadata_list
+        if note_metadata_list is None:
+            changed_notes, update_count = sync_engine.get_changed_notes("events", ["Events"])
+
+        event_index = CalendarEventIndex(settings.CALENDAR_EVENT_INDEX_LOCATION)
+        events, invalid_notes = evernote_client.get_new_events(since=last_successful_check_time, sync_engine=sync_engine,
+                                                event_index=event_index, note_metadata_list=changed_notes)
         logging.debug("Evernote connection was successful")
 
     except EvernoteConnectorException as e:
         logging.critical("There was an error with the EvernoteConnector: " + e.msg)
         return
 
-    logging.info('Found ' + str(len(events)) + ' new events:')
+    logging.info('Found ' + str(len(events)) + ' new or changed events:')
 
     for event in events:
         logging.debug('StartTime: ' + event.start_time.strftime('%Y-%m-%d %H%M') +
                       ', EndTime: ' + event.end_time.strftime('%Y-%m-%d %H%M') +
                       ", Title: '" + event.title + "'")
 
-    # Add new events to Google Calender
+    # Add new events to Google Calender, and update the ones which have changed.
+    # Events which have already been written are recorded in the index, so retrying never duplicates them.
 
     if len(events) > 0:
-        logging.info('Adding new events to Google Calendar')
-        google_client = GoogleCalendarConnector(credentials_file=settings.GOOGLE_CREDENTIALS_FILE)
-        google_client.add_new_events(events)
+        logging.info('Syncing events to Google Calendar')
+        google_client = get_google_client()
+        failed_events = google_client.sync_events(events, event_index)
 
-    save_successful_check_time(settings.LATEST_EVERNOTE_CHECK_TIME_LOCATION,current_check_time)
-    logging.info('Completed processing events, saved check time as ' + current_check_time)
-
-def get_stored_goal_states(stored_states_location):
+        if len(failed_events) > 0:
+            logging.critical("Failed to write " + str(len(failed_events)) + " events to Google Calendar, not saving check time")
+            return
 
-    if path.exists(stored_states_location):
-        with open(stored_states_location) as f:
-            stored_goal_states = json.load(f)
-    else:
-        stored_goal_states = {}
-        stored_goal_states["Backlog"] = []
-        stored_goal_states["Current"] = []
-        stored_goal_states["Complete"] = []
-        stored_goal_states["Dropped"] = []
+    if note_metadata_list is not None:
+        logging.info('Completed processing ' + str(len(note_metadata_list)) + ' event notes')
+        return
 
-    return stored_goal_states
+    if len(invalid_notes) > 0:
+        # Leave the check time where it is so the notes are picked up again once their titles are fixed
+        logging.critical("Skipped " + str(len(invalid_notes)) + " event notes with invalid titles, not saving check time")
+        return
 
-def save_stored_goal_states(stored_states_location,states_to_store):
-    with open(stored_states_location, 'w') as f:
-        json.dump(states_to_store, f)
+    save_successful_check_time(settings.LATEST_EVERNOTE_CHECK_TIME_LOCATION,current_check_time)
+    sync_engine.commit_cursor("events", update_count)
+    logging.info('Completed processing events, saved check time as ' + current_check_time)
 
-def process_goals():
+@tag_job("goals")
+def process_goals(evernote_client, sync_engine, note_metadata_list=None):
 
-    previous_goal_states = get_stored_goal_states(settings.STORED_GOAL_STATES_LOCATION)
+    goal_state_store = GoalStateStore(settings.GOAL_STATES_LOCATION, settings.STORED_GOAL_STATES_LOCATION)
 
     logging.info("Processing goal state-changes")
-    evernote_client = EvernoteConnector(token=settings.EVERNOTE_AUTH_TOKEN,sandbox=settings.EVERNOTE_SANDBOX_MODE)
-    new_goal_states = evernote_client.process_goal_updates(previous_goal_states)
+    changed_notes = note_metadata_list
+    if note_metadata_list is None:
+        changed_notes, update_count = sync_engine.get_changed_notes("goals", GOAL_NOTEBOOKS)
 
-    save_stored_goal_states(settings.STORED_GOAL_STATES_LOCATION,new_goal_states)
+    evernote_client.process_goal_updates(goal_state_store, sync_engine, changed_notes)
+
+    # Only the goals which changed state are written
+    goal_state_store.commit()
+    if note_metadata_list is None:
+        sync_engine.commit_cursor("goals", update_count)
     logging.info("Completed processing goals")
 
+def get_mendeley_checkpoint(checkpoint_location):
+    # Returns the last document imported by a run which didn't complete, or None
+
+    if not path.exists(checkpoint_location):
+        return None
+
+    with open(checkpoint_location, 'r') as f:
+        checkpoint = json.load(f)
+
+    checkpoint["created"] = datetime.strptime(checkpoint["created"], "%Y%m%dT%H%M%S.%f")
+    return checkpoint
+
+def save_mendeley_checkpoint(checkpoint_location, doc):
+
+    # Written to a temporary file first so a crash can't leave a half written checkpoint
+    with open(checkpoint_location + ".tmp", 'w') as f:
+        json.dump({"id": doc["id"], "created": doc["created"].strftime("%Y%m%dT%H%M%S.%f")}, f)
+    rename(checkpoint_location + ".tmp", checkpoint_location)
+
+def skip_checkpointed_documents(docs, checkpoint):
+    # The import resumes from the checkpointed document's created time, so the documents created at the same time
+    # come back again. Those up to and including the checkpointed one were imported and are skipped, unless it has
+    # since been deleted, in which case none of them are.
+
+    past_checkpoint = False
+    tied_docs = []
+
+    for doc in docs:
+        if not past_checkpoint and doc["created"] == checkpoint["created"]:
+            if doc["id"] == checkpoint["id"]:
+                past_checkpoint = True
+                tied_docs = []
+            else:
+                tied_docs.append(doc)
+            continue
+
+        for tied_doc in tied_docs:
+            yield tied_doc
+        past_checkpoint = True
+        tied_docs = []
+
+        yield doc
+
+    for tied_doc in tied_docs:
+        yield tied_doc
+
+def iter_mendeley_documents_in_background(mendeley_client, since):
+    # Fetches documents from Mendeley on another thread, so notes are created while later pages are still downloading.
+    # The queue is bounded, so Mendeley is never read too far ahead of Evernote.
+
+    documents = Queue(maxsize=MENDELEY_QUEUE_SIZE)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                documents.put(item, timeout=1)
+                return
+            except Full:
+                pass
+
+    def produce():
+        try:
+            for doc in mendeley_client.iter_new_documents(since):
+                put((doc, None))
+                if stopped.is_set():
+                    return
+        except Exception as e:
+            put((None, e))
+            return
+        put((None, None))
+
+    producer = threading.Thread(target=propagate_job(produce), name="MendeleyProducer")
+    producer.daemon = True
+    producer.start()
+
+    try:
+        while True:
+            doc, error = documents.get()
+            if error is not None:
+                raise error
+            if doc is None:
+                return
+            yield doc
+    finally:
+        # Lets the producer finish if the import stops early
+        stopped.set()
+
+@tag_job("mendeley")
 def process_mendeley():
 
     current_check_time = datetime.now().strftime("%Y%m%dT%H%M%S")
     last_successful_check_time = get_last_successful_check_time(settings.LATEST_MENDELEY_CHECK_TIME_LOCATION)
 
-    # Get the list of new documents according to last check time
-    mendeley_client = MendeleyConnector(settings.MENDELEY_CREDENTIALS_FILE)
+    since = datetime.strptime(last_successful_check_time, '%Y%m%dT%H%M%S')
+
+    # Documents arrive oldest first, so a run which failed part way through can carry on after the last one imported
+    checkpoint = get_mendeley_checkpoint(settings.MENDELEY_CHECKPOINT_LOCATION)
+    if checkpoint is not None and checkpoint["created"] < since:
+        checkpoint = None
+    if checkpoint is not None:
+        logging.info("Resuming the Mendeley import after document " + checkpoint["id"])
+        since = checkpoint["created"]
 
-    last_check_datetime = datetime.strptime(last_successful_check_time, '%Y%m%dT%H%M%S')
+    mendeley_client = get_mendeley_client()
+    docs = iter_mendeley_documents_in_background(mendeley_client, since)
 
-    docs = mendeley_client.get_new_documents(since=last_check_datetime)
-    mendeley_client = None
+    new_docs = docs
+    if checkpoint is not None:
+        new_docs = skip_checkpointed_documents(docs, checkpoint)
 
-    if len(docs) > 0:
+    try:
+        first_doc = next(new_docs, None)
+        if first_doc is not None:
 
-        # Add each document as a new note in Evernote
-        logging.info("Adding " + str(len(docs)) + " mendeley docs to Evernote")
-        evernote_client = EvernoteConnector(token=settings.EVERNOTE_AUTH_TOKEN,sandbox=settings.EVERNOTE_SANDBOX_MODE)
-        evernote_client.add_new_mendeley_docs(docs)
+            # Add each document as a new note in Evernote as it arrives
+            logging.info("Adding new mendeley docs to Evernote")
+            evernote_client, sync_engine = get_synced_evernote_client()
+            rejected_docs = evernote_client.add_new_mendeley_docs(
+                chain([first_doc], new_docs),
+                doc_added=lambda doc: save_mendeley_checkpoint(settings.MENDELEY_CHECKPOINT_LOCATION, doc))
+
+            # Rejected documents would be rejected again, so they don't stop the check time being saved
+            if len(rejected_docs) > 0:
+                logging.critical("Evernote rejected " + str(len(rejected_docs)) + " mendeley docs: "
+                                 + ", ".join("'" + doc["title"] + "'" for doc in rejected_docs))
+
+    except EvernoteConnectorException as e:
+        # The checkpoint is kept, so the next run carries on from the document which failed
+        logging.critical("There was an error with the EvernoteConnector: " + str(e.msg))
+        return
+    finally:
+        docs.close()
 
     save_successful_check_time(settings.LATEST_MENDELEY_CHECK_TIME_LOCATION,current_check_time)
+    if path.exists(settings.MENDELEY_CHECKPOINT_LOCATION):
+        remove(settings.MENDELEY_CHECKPOINT_LOCATION)
     logging.info('Completed processing mendeley docs, saved check time as ' + current_check_time)
 
+def run_jobs(jobs, concurrency, timeout):
+    # Runs a list of (name, function) jobs on a pool of threads. A job which fails is logged without
+    # affecting the others, and a job which runs for longer than the timeout (in seconds) stops being waited for.
+
+    start_times = {}
+
+    def run_job(name, job):
+        start_times[name] = time.time()
+        print("Processing " + name)
+        try:
+            job()
+        except SystemExit:
+            raise RuntimeError("exited")
+        print("Completed " + name + " Processing")
+
+    pool = ThreadPool(concurrency)
+    results = [(name, pool.apply_async(run_job, (name, job))) for name, job in jobs]
+    pool.close()
+
+    # Jobs queued behind others still have to start within this time
+    start_deadline = time.time() + timeout * len(jobs)
+
+    for name, result in results:
+        try:
+            while name not in start_times and not result.ready() and time.time() < start_deadline:
+                result.wait(1)
+
+            job_deadline = start_times.get(name, start_deadline - timeout) + timeout
+            result.get(max(job_deadline - time.time(), 0))
+
+        except TimeoutError:
+            logging.critical("The " + name + " job didn't finish within " + str(timeout) + " seconds")
+        except Exception as e:
+            logging.critical("The " + name + " job failed: " + str(getattr(e, 'msg', e)))
+
+def get_evernote_jobs(evernote_client, sync_engine):
+    return [("Events", lambda: process_events(evernote_client, sync_engine)),
+            ("Goals", lambda: process_goals(evernote_client, sync_engine))]
+
 def run():
 
-    print("Processing Events")
-    process_events()
-    print("Completed Events Processing")
+    jobs = []
+
+    try:
+        evernote_client, sync_engine = get_synced_evernote_client()
+        jobs.extend(get_evernote_jobs(evernote_client, sync_engine))
+    except EvernoteConnectorException as e:
+        logging.critical("There was an error syncing with Evernote: " + str(e.msg))
+
+    jobs.append(("Mendeley", process_mendeley))
+
+    # The jobs use different notebooks and services, and share the Evernote rate limiter
+    run_jobs(jobs, settings.JOB_CONCURRENCY, settings.JOB_TIMEOUT)
 
-    print("Processing Goals")
-    process_goals()
-    print("Completed Goals Processing")
-    
-    print("Processing Mendeley")
-    process_mendeley()
-    print("Completed Mendeley Processing")
+    save_api_metrics()
 
     print("Waiting for next execution")
 
+def save_api_metrics():
+    # The counts cover every call since the service started, including those made by polling and webhooks
+
+    try:
+        api_metrics.save_snapshot(settings.API_METRICS_LOCATION)
+    except IOError as e:
+        logging.error("Couldn't save the API metrics: " + str(e))
+
+def poll_for_changes():
+
+    # When nothing has changed this is a single getSyncState call. A failed poll is only logged, since the
+    # next one will try again, and anything raised here would stop the scheduler and the service with it.
+    try:
+        evernote_client, sync_engine = get_synced_evernote_client()
+    except EvernoteConnectorException as e:
+        logging.error("There was an error polling Evernote for changes: " + str(e.msg))
+        return
+    except (TTransportException, socket.error) as e:
+        logging.error("Couldn't connect to Evernote to poll for changes: " + str(e))
+        return
+
+    update_count = sync_engine.get_update_count()
+    if update_count == last_poll["update_count"] or not sync_engine.has_pending_changes(["events", "goals"]):
+        return
+    last_poll["update_count"] = update_count
+
+    logging.info("Evernote has changed, processing events and goals")
+    run_jobs(get_evernote_jobs(evernote_client, sync_engine), settings.JOB_CONCURRENCY, settings.JOB_TIMEOUT)
+
+def process_webhook_notifications(notifications):
+
+    try:
+        evernote_client, sync_engine = get_synced_evernote_client()
+    except EvernoteConnectorException as e:
+        logging.error("There was an error syncing with Evernote: " + str(e.msg))
+        return
+
+    event_notes = []
+    goal_notes = []
+
+    for notification in notifications:
+
+        # The synced metadata says which notebook the note is in now, even if it has moved since the notification
+        note_metadata = sync_engine.get_note(notification.note_guid)
+        if note_metadata is None:
+            logging.debug("Ignoring notification for note " + notification.note_guid + " which is no longer active")
+            continue
+
+        notebook_name = sync_engine.get_notebook_name(note_metadata.notebookGuid)
+        if notebook_name == "Events":
+            event_notes.append(note_metadata)
+        elif notebook_name in GOAL_NOTEBOOKS:
+            goal_notes.append(note_metadata)
+        elif notebook_name == "Daily":
+            # Daily logs are only read when the weekly summary is made, which the sync above has prepared for
+            logging.debug("Daily log " + note_metadata.title + " has changed")
+
+    jobs = []
+    if len(event_notes) > 0:
+        jobs.append(("Events", lambda: process_events(evernote_client, sync_engine, event_notes)))
+    if len(goal_notes) > 0:
+        jobs.append(("Goals", lambda: process_goals(evernote_client, sync_engine, goal_notes)))
+
+    run_jobs(jobs, settings.JOB_CONCURRENCY, settings.JOB_TIMEOUT)
+
+@tag_job("summary")
 def summarise_log():
 
     print("Summarising the log")
     logging.info("Summarising the daily logs into a weekly log")
 
     # concatenate all the daily logs for the week
-    # create a new note in weekly logs with that content
-
-    # The week is Monday 00:00:00 to Sunday 23:59:59
-    start_time = get_start_of_week(datetime.now())
-    end_time = get_end_of_week(datetime.now())
+    # create a new note in weekly logs with that content, or update the one already written this week
 
     try:
-        evernote_client = EvernoteConnector(token=settings.EVERNOTE_AUTH_TOKEN, sandbox=settings.EVERNOTE_SANDBOX_MODE)
+        evernote_client, sync_engine = get_synced_evernote_client()
 
-        summary_content = evernote_client.get_concatenated_daily_logs(start_time, end_time)
+        summary_title, start_timestamp, end_timestamp = get_weeks(datetime.now(), datetime.now())[0]
+        note_metadata_list = list(sync_engine.get_notes_created_between("Daily", start_timestamp, end_timestamp))
 
-        first_day_of_this_week = datetime.now() - timedelta(days=datetime.now().weekday())
-        summary_title = datetime.strftime(first_day_of_this_week,"W/C %Y-%m-%d")
-
-        evernote_client.create_summary_log("Summaries", summary_title, summary_content)
+        write_summary_logs(evernote_client, sync_engine, [(summary_title, note_metadata_list)])
 
         logging.info("Completed summarising the daily logs into a weekly log")
 
     except EvernoteConnectorException as e:
-        logging.critical("There was an error with the EvernoteConnector: " + e.msg)
+        logging.critical("There was an error with the EvernoteConnector: " + str(e.msg))
         return
+    finally:
+        save_api_metrics()
 
     print("Completed summarising the log")
 
+def write_summary_logs(evernote_client, sync_engine, summaries):
+
+    summary_index = WeeklySummaryIndex(settings.SUMMARY_INDEX_LOCATION)
+    results = evernote_client.sync_summary_logs("Summaries", summaries, summary_index, sync_engine)
+
+    failed_results = [result for result in results if result.error is not None]
+    for result in failed_results:
+        logging.critical("Failed to write the summary '" + result.note.title + "': " + str(result.error))
+
+    logging.info("Wrote " + str(len(results) - len(failed_results)) + " weekly summaries")
+
+def get_weeks(start_date, end_date):
+    # Returns (summary title, start timestamp, end timestamp) for each week from the one containing start_date
+    # to the one containing end_date, with the timestamps in milliseconds as used by note.created
+
+    weeks = []
+
+    monday = start_date - timedelta(days=start_date.weekday())
+    while monday <= end_date:
+        weeks.append((datetime.strftime(monday, "W/C %Y-%m-%d"),
+                      convert_evernote_time_to_timestamp(get_start_of_week(monday)),
+                      convert_evernote_time_to_timestamp(get_end_of_week(monday))))
+        monday += timedelta(weeks=1)
+
+    return weeks
+
+@tag_job("summary")
+def backfill_summaries(start_date, end_date):
+    # Writes the weekly summary for every finished week in the range which has daily logs,
+    # unless it is already up to date
+
+    logging.info("Backfilling weekly summaries from " + start_date.strftime("%Y-%m-%d") + " to " + end_date.strftime("%Y-%m-%d"))
+
+    try:
+        evernote_client, sync_engine = get_synced_evernote_client()
+
+        now_timestamp = convert_evernote_time_to_timestamp(datetime.utcnow().strftime("%Y%m%dT%H%M%S"))
+        weeks = [week for week in get_weeks(start_date, end_date) if week[2] < now_timestamp]
+
+        if len(weeks) == 0:
+            logging.info("No finished weeks in the range")
+            return
+
+        # One query over the whole range, with the daily logs sorted into weeks locally
+        week_starts = [week_start for title, week_start, week_end in weeks]
+        daily_logs = [[] for week in weeks]
+
+        for note_metadata in sync_engine.get_notes_created_between("Daily", weeks[0][1], weeks[-1][2]):
+            week_index = bisect_right(week_starts, note_metadata.created) - 1
+            daily_logs[week_index].append(note_metadata)
+
+        # Weeks whose summary is already up to date are skipped without fetching their daily logs
+        write_summary_logs(evernote_client, sync_engine, [(week[0], note_metadata_list)
+                                                          for week, note_metadata_list in zip(weeks, daily_logs)])
+
+    except EvernoteConnectorException as e:
+        logging.critical("There was an error with the EvernoteConnector: " + str(e.msg))
+        return
+
 # Initialise logging
 
 logging.basicConfig(filename=settings.LOG_LOCATION, level=settings.LOGGING_LEVEL,
                     format='%(asctime)s [%(levelname)s]: %(message)s')
 
+# python -m src.evernote_service --backfill-summaries yyyy-mm-dd yyyy-mm-dd creates any missing summaries then exits
+if len(sys.argv) == 4 and sys.argv[1] == "--backfill-summaries":
+    backfill_summaries(datetime.strptime(sys.argv[2], "%Y-%m-%d"), datetime.strptime(sys.argv[3], "%Y-%m-%d"))
+    exit(0)
+
 # Run once when process is started then schedule it to run on its time
 schedule.every().day.at(settings.CHECK_TIME).do(run)
 schedule.every().sunday.at("23:00").do(summarise_log)
 
+if settings.POLL_INTERVAL_MINUTES is not None:
+    schedule.every(settings.POLL_INTERVAL_MINUTES).minutes.do(poll_for_changes)
+
+if settings.WEBHOOK_PORT is not None:
+    webhook_receiver = WebhookReceiver(settings.WEBHOOK_PORT, process_webhook_notifications)
+    webhook_receiver.start()
+
 try:
     run()
     while True:
@@ -0,0 +1,150 @@
+from evernote.edam.notestore.ttypes import SyncChunkFilter
+from evernote.edam.error.ttypes import EDAMUserException, EDAMSystemException, EDAMNotFoundException
+
+from evernote_connector import EvernoteConnectorException
+
+import logging
+
+# Number of objects to request per getFilteredSyncChunk call
+SYNC_CHUNK_SIZE = 100
+
+
+class EvernoteSyncEngine():
+    # Keeps the local metadata cache up to date using the account's update sequence number (USN).
+    # Each consumer (events, goals, daily logs) keeps its own cursor into the cache, so a single
+    # getSyncState call is enough to find out that nothing has changed.
+
+    def __init__(self, evernote_client, metadata_cache, chunk_size=SYNC_CHUNK_SIZE):
+        self.evernote_client = evernote_client
+        self.metadata_cache = metadata_cache
+        self.chunk_size = chunk_size
+
+    def sync(self):
+        # Returns True if anything changed in the account since the last sync
+
+        # Holding the cache lock stops other jobs committing a partly merged sync
+        with self.metadata_cache.lock:
+            return self.sync_metadata_cache()
+
+    def sync_metadata_cache(self):
+
+        try:
+
+            note_store = self.evernote_client.get_note_store()
+            sync_state = note_store.getSyncState(self.evernote_client.auth_token)
+
+            if sync_state.fullSyncBefore > self.metadata_cache.get_value("last_sync_time"):
+                logging.info("Evernote requested a full sync, discarding the local metadata cache")
+                self.metadata_cache.clear()
+
+            previous_update_count = self.metadata_cache.get_update_count()
+
+            if sync_state.updateCount == previous_update_count:
+                logging.debug("No Evernote changes since update count " + str(sync_state.updateCount))
+                return False
+
+            chunk_filter = SyncChunkFilter(includeNotes=True, includeNotebooks=True, includeTags=True,
+                                           includeExpunged=True)
+
+            after_usn = previous_update_count
+            while after_usn < sync_state.updateCount:
+
+                sync_chunk = note_store.getFilteredSyncChunk(self.evernote_client.auth_token, after_usn,
+                                                             self.chunk_size, chunk_filter)
+                self.merge_sync_chunk(sync_chunk)
+
+                if sync_chunk.chunkHighUSN is None:
+                    # nothing left that matches our filter
+                    break
+                after_usn = sync_chunk.chunkHighUSN
+
+            logging.debug("Synced Evernote changes from update count " + str(previous_update_count)
+                          + " to " + str(sync_state.updateCount))
+
+            self.metadata_cache.set_value("update_count", sync_state.updateCount)
+            self.metadata_cache.set_value("last_sync_time", sync_state.currentTime)
+            self.metadata_cache.commit()
+
+            return True
+
+        except (EDAMUserException, EDAMSystemException, EDAMNotFoundException) as e:
+            raise EvernoteConnectorException(e)
+
+    def merge_sync_chunk(self, sync_chunk):
+
+        for notebook in sync_chunk.notebooks or []:
+            self.metadata_cache.put_notebook(notebook)
+
+        for tag in sync_chunk.tags or []:
+            self.metadata_cache.put_tag(tag)
+
+        for note in sync_chunk.notes or []:
+            self.metadata_cache.put_note(note)
+
+        for notebook_guid in sync_chunk.expungedNotebooks or []:
+            self.metadata_cache.expunge_notebook(notebook_guid)
+
+        for tag_guid in sync_chunk.expungedTags or []:
+            self.metadata_cache.expunge_tag(tag_guid)
+
+        for note_guid in sync_chunk.expungedNotes or []:
+            self.metadata_cache.expunge_note(note_guid)
+
+    def get_notebook_guid(self, notebook_name):
+
+        notebook_guid = self.metadata_cache.get_notebook_guid(notebook_name)
+
+        if notebook_guid is None:
+            raise EvernoteConnectorException("Unable to find a notebook with the name '" + notebook_name + "'")
+
+        return notebook_guid
+
+    def get_notebook_name(self, notebook_guid):
+        return self.metadata_cache.get_notebook_name(notebook_guid)
+
+    def get_note(self, note_guid):
+        return self.metadata_cache.get_note(note_guid)
+
+    def get_changed_notes(self, cursor_name, notebook_names):
+        # Returns the active notes in the given notebooks which have changed since the cursor was last committed,
+        # along with the update count they go up to, which the cursor is committed as once they are processed.
+        # Other jobs can sync while the notes are being processed, and anything they sync is left for the next run.
+
+        cursor = self.metadata_cache.get_value("cursor:" + cursor_name)
+        update_count = self.metadata_cache.get_update_count()
+        notebook_guids = [self.get_notebook_guid(notebook_name) for notebook_name in notebook_names]
+
+        changed_notes = self.metadata_cache.find_notes("usn > ? AND usn <= ? AND notebook_guid IN ("
+                                                       + ",".join("?" * len(notebook_guids)) + ")",
+                                                       [cursor, update_count] + notebook_guids)
+
+        return changed_notes, update_count
+
+    def get_notes_created_between(self, notebook_name, start_timestamp, end_timestamp):
+        # Timestamps are milliseconds since the epoch, as used by Evernote
+
+        return self.metadata_cache.find_notes("notebook_guid = ? AND created BETWEEN ? AND ?",
+                                              (self.get_notebook_guid(notebook_name), start_timestamp, end_timestamp))
+
+    def get_notes_in_notebook(self, notebook_name):
+        return self.metadata_cache.find_notes("notebook_guid = ?", (self.get_notebook_guid(notebook_name),))
+
+    def get_update_count(self):
+        return self.metadata_cache.get_update_count()
+
+    def has_pending_changes(self, cursor_names):
+        # True if any of the consumers hasn't yet processed everything synced so far
+
+        update_count = self.metadata_cache.get_update_count()
+
+        for cursor_name in cursor_names:
+            if self.metadata_cache.get_value("cursor:" + cursor_name) < update_count:
+                return True
+
+        return False
+
+    def commit_cursor(self, cursor_name, update_count):
+        # Marks the changes up to the update count returned by get_changed_notes as processed for this consumer
+
+        self.metadata_cache.set_value("cursor:" + cursor_name, update_count)
+        self.metadata_cache.commit()
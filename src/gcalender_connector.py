@@ -2,15 +2,58 @@ from oauth2client import tools
 from oauth2client.client import OAuth2WebServerFlow
 from oauth2client.file import Storage
 from apiclient import discovery
+from apiclient.errors import HttpError
+
+from api_metrics import api_metrics, instrument_http
 
-from xml.etree import cElementTree
 import argparse
+import hashlib
 import httplib2
 import json
 import logging
+import time
+from os import path
 
 TIMEZONE_OFFSET = '+01'
 
+# Google allows at most 50 calls in a single batch request
+MAX_BATCH_SIZE = 50
+
+# The discovery document rarely changes, so it is only fetched again once the cached copy is this old
+DISCOVERY_CACHE_TTL = 24 * 60 * 60
+
+DISCOVERY_URL = 'https://www.googleapis.com/discovery/v1/apis/calendar/v3/rest'
+
+
+# Returns the calendar API discovery document, from the cache file unless it has expired
+def get_discovery_document(cache_location):
+
+    if path.exists(cache_location) and time.time() - path.getmtime(cache_location) < DISCOVERY_CACHE_TTL:
+        with open(cache_location) as f:
+            return f.read()
+
+    try:
+        response, content = httplib2.Http().request(DISCOVERY_URL)
+        if response.status != 200:
+            raise IOError("Unexpected status " + str(response.status) + " fetching " + DISCOVERY_URL)
+    except (IOError, httplib2.HttpLib2Error) as e:
+        if path.exists(cache_location):
+            logging.info("Couldn't refresh the calendar discovery document, using the expired copy: " + str(e))
+            with open(cache_location) as f:
+                return f.read()
+        raise
+
+    with open(cache_location, 'w') as f:
+        f.write(content)
+
+    return content
+
+
+# Calendar event ids may only use the characters a-v and 0-9, which covers a note guid without its dashes
+def get_calendar_event_id(note_guid):
+    return "evernote" + note_guid.replace("-", "").lower()
+
+
 class GoogleCalendarConnector():
     def __init__(self, credentials_file):
 
@@ -49,43 +92,103 @@ class GoogleCalendarConnector():
             gcredentials = tools.run_flow(flow, storage, flags)
 
         storage.put(gcredentials)
-        http = gcredentials.authorize(httplib2.Http())
-        self.service = discovery.build('calendar', 'v3', http=http)
+        http = instrument_http(gcredentials.authorize(httplib2.Http()), api_metrics, "calendar")
+        discovery_document = get_discovery_document(credentials_file + ".discovery.json")
+        self.service = discovery.build_from_document(discovery_document, http=http)
 
         logging.debug('Successfully authenticated with Google and created service object')
 
-    def add_new_events(self, events):
+    def sync_events(self, events, event_index):
+        # Inserts new events and patches changed ones, returning the events which could not be written
+
+        pending_writes = []
         for event in events:
-            json_data = json.loads(self.convert_event_to_calendar_format(event))
-            self.service.events().insert(calendarId='primary', body=json_data).execute()
 
-            logging.debug('Added a new event:')
-            logging.debug('StartTime: ' + json_data['start']['dateTime'] +
-                  ', EndTime: ' + json_data['start']['dateTime'] +
-                  ", Title: '" + json_data['summary'] + "'")
+            calendar_event = self.convert_event_to_calendar_format(event)
+            content_hash = hashlib.sha1(json.dumps(calendar_event, sort_keys=True)).hexdigest()
 
-        logging.info('Successfully added ' + str(len(events)) + ' new events to Google Calendar')
+            indexed_event = event_index.get(event.note_guid)
+            if indexed_event is None:
+                pending_writes.append((event, calendar_event, content_hash, None))
+            elif indexed_event[1] != content_hash:
+                pending_writes.append((event, calendar_event, content_hash, indexed_event[0]))
+            else:
+                logging.debug("Event '" + event.title + "' is unchanged since it was last synced")
 
-    def convert_event_to_calendar_format(self,event):
+        failed_events = []
+        for batch_start in range(0, len(pending_writes), MAX_BATCH_SIZE):
+            failed_events.extend(self.write_event_batch(pending_writes[batch_start:batch_start + MAX_BATCH_SIZE],
+                                                        event_index))
+
+        logging.info('Successfully wrote ' + str(len(pending_writes) - len(failed_events)) + ' events to Google Calendar')
+
+        return failed_events
+
+    def write_event_batch(self, pending_writes, event_index):
+        # Takes a list of (event, calendar event, content hash, calendar event id) where the id is None for new events.
+        # All the writes are sent in a single HTTP request, and each one is recorded in the index as soon as it succeeds.
+
+        failed_indices = []
+
+        def write_callback(request_id, response, exception):
+            event, calendar_event, content_hash, calendar_event_id = pending_writes[int(request_id)]
 
-        start = {'dateTime': event.start_time.strftime('%Y-%m-%dT%H:%M:00' + TIMEZONE_OFFSET + ':00'),
-                 'timeZone': 'Europe/London'}
-        end = {'dateTime': event.end_time.strftime('%Y-%m-%dT%H:%M:00' + TIMEZONE_OFFSET + ':00'),
-               'timeZone': 'Europe/London'}
+            if isinstance(exception, HttpError) and exception.resp.status == 409:
+                # A previous run inserted the event but didn't get as far as recording it
+                calendar_event_id = get_calendar_event_id(event.note_guid)
+                try:
+                    response = self.service.events().patch(calendarId='primary', eventId=calendar_event_id,
+                                                           body=calendar_event).execute()
+                    exception = None
+                except HttpError as e:
+                    exception = e
 
-        content_root = cElementTree.fromstring(event.content)
+            if exception is not None:
+                logging.error("Failed to write event '" + calendar_event['summary'] + "': " + str(exception))
+                failed_indices.append(int(request_id))
+                return
 
-        content = None
-        for child in content_root:
-            content = child.text
+            # All day events only have a date
+            start = calendar_event['start']
+            end = calendar_event['end']
+            logging.debug('Wrote event:')
+            logging.debug('StartTime: ' + start.get('dateTime', start.get('date')) +
+                  ', EndTime: ' + end.get('dateTime', end.get('date')) +
+                  ", Title: '" + calendar_event['summary'] + "'")
 
-        event_description = {'summary': event.title,
-                             'location': event.location,
-                             'description': content,
-                             'start': start,
-                             'end': end
-                             }
+            event_index.put(event.note_guid, response['id'], content_hash)
 
-        json_data = json.dumps(event_description)
-        return json_data
+        batch = self.service.new_batch_http_request(callback=write_callback)
+        for index, (event, calendar_event, content_hash, calendar_event_id) in enumerate(pending_writes):
 
+            if calendar_event_id is None:
+                # Deriving the id from the note means inserting the same event twice is rejected rather than duplicated
+                insert_body = dict(calendar_event, id=get_calendar_event_id(event.note_guid))
+                request = self.service.events().insert(calendarId='primary', body=insert_body)
+            else:
+                request = self.service.events().patch(calendarId='primary', eventId=calendar_event_id,
+                                                      body=calendar_event)
+
+            batch.add(request, request_id=str(index))
+        batch.execute()
+
+        return [pending_writes[index][0] for index in sorted(failed_indices)]
+
+    def convert_event_to_calendar_format(self,event):
+
+        if event.all_day:
+            # Google treats the end date of an all day event as exclusive, as does the parsed end_time
+            start = {'date': event.start_time.strftime('%Y-%m-%d')}
+            end = {'date': event.end_time.strftime('%Y-%m-%d')}
+        else:
+            start = {'dateTime': event.start_time.strftime('%Y-%m-%dT%H:%M:00' + TIMEZONE_OFFSET + ':00'),
+                     'timeZone': 'Europe/London'}
+            end = {'dateTime': event.end_time.strftime('%Y-%m-%dT%H:%M:00' + TIMEZONE_OFFSET + ':00'),
+                   'timeZone': 'Europe/London'}
+
+        return {'summary': event.title,
+                'location': event.location,
+                'description': event.description,
+                'start': start,
+                'end': end
+                }
@@ -0,0 +1,49 @@
+from os import path
+import sqlite3
+import logging
+import json
+
+
+class GoalStateStore():
+    # Records which goal notebook each goal note was in when it was last processed.
+    # Changes are held in the SQLite transaction until commit, so a failed run leaves the previous states intact.
+
+    def __init__(self, store_location, legacy_states_location=None):
+        self.connection = sqlite3.connect(store_location)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS goal_states (note_guid TEXT PRIMARY KEY, notebook_name TEXT NOT NULL)")
+        self.connection.commit()
+
+        if legacy_states_location is not None and path.exists(legacy_states_location) and self.is_empty():
+            self.import_legacy_states(legacy_states_location)
+
+    def is_empty(self):
+        return self.connection.execute("SELECT COUNT(*) FROM goal_states").fetchone()[0] == 0
+
+    def import_legacy_states(self, legacy_states_location):
+        # The states used to be stored as a JSON list of guids per notebook
+
+        with open(legacy_states_location) as f:
+            legacy_states = json.load(f)
+
+        for notebook_name, note_guids in legacy_states.items():
+            for note_guid in note_guids:
+                self.set_state(note_guid, notebook_name)
+        self.commit()
+
+        logging.info("Imported goal states from " + legacy_states_location)
+
+    def get_state(self, note_guid):
+        # Returns the notebook the goal was last seen in, or None if it is a new goal
+
+        row = self.connection.execute("SELECT notebook_name FROM goal_states WHERE note_guid = ?", (note_guid,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def set_state(self, note_guid, notebook_name):
+        self.connection.execute("INSERT OR REPLACE INTO goal_states (note_guid, notebook_name) VALUES (?, ?)",
+                                (note_guid, notebook_name))
+
+    def commit(self):
+        self.connection.commit()
@@ -18,8 +18,13 @@ from mendeley.session import MendeleySession
 from mendeley.auth import MendeleyClientCredentialsTokenRefresher,MendeleyAuthorizationCodeTokenRefresher
 from mendeley.exception import MendeleyApiException
 
+from api_metrics import api_metrics, instrument_mendeley_session
+
 TIMEZONE_OFFSET = '+01'
 
+# The largest page the Mendeley API will return
+MENDELEY_PAGE_SIZE = 500
+
 class MendeleyConnector():
     def __init__(self, credentials_file):
 
@@ -71,69 +76,77 @@ class MendeleyConnector():
             creds,
             client=auth.client,
             refresher=MendeleyClientCredentialsTokenRefresher(auth))
-        
+        instrument_mendeley_session(self.session, api_metrics)
+
+        # Kept so that the access token can be refreshed when it is next needed, rather than on every start
+        self.auth = auth
+        self.mcredentials = mcredentials
+        self.storage = storage
+
+        logging.debug('Successfully authenticated with Mendeley and created service object')
+
+    def refresh_token_if_expired(self):
+
         time_now = datetime.now()
 
-        if time_now >= mcredentials.token_expiry:
+        if time_now >= self.mcredentials.token_expiry:
             logging.debug("Mendeley access token has expired. Refreshing...")
 
-            refresher = MendeleyAuthorizationCodeTokenRefresher(auth)
+            refresher = MendeleyAuthorizationCodeTokenRefresher(self.auth)
             refresher.refresh(self.session)
 
-            mcredentials.access_token = self.session.token["access_token"]
-            mcredentials.refresh_token = self.session.token["refresh_token"]
+            self.mcredentials.access_token = self.session.token["access_token"]
+            self.mcredentials.refresh_token = self.session.token["refresh_token"]
 
             expiry = datetime.fromtimestamp(self.session.token["expires_at"])
-            mcredentials.token_expiry = expiry
+            self.mcredentials.token_expiry = expiry
 
-            storage.put(mcredentials)
+            self.storage.put(self.mcredentials)
 
-        logging.debug('Successfully authenticated with Mendeley and created service object')
+    def iter_new_documents(self, since):
+        # Yields the documents added at or after the given (naive UTC) datetime, oldest first, as they arrive from Mendeley.
+        # The server only returns documents modified since then, so the library isn't paged through on every run.
 
-    def get_new_documents(self,since):
-    
-        documents = []
+        self.refresh_token_if_expired()
 
-        docs = self.session.documents.iter(view='tags')
+        docs = self.session.documents.iter(page_size=MENDELEY_PAGE_SIZE, view='tags', sort='created', order='asc',
+                                           modified_since=since.strftime('%Y-%m-%dT%H:%M:%SZ'))
         for doc in docs:
 
             if doc.tags != None and "mendeley" in doc.tags:
-                print "Skipping " + doc.title
+                logging.debug("Skipping " + doc.title)
                 continue
 
-            if doc.created.naive > since:
-
-                authors = []
-                if doc.authors != None:
-                    for author in doc.authors:
-                        first = ""
-                        second = ""
-                        if author.first_name != None:
-                            first = unidecode(author.first_name)
-                        if author.last_name != None:
-                            second = unidecode(author.last_name)
-
-                        authors.append({"first":first,"second":second})
-
-                title = ""
-                source = ""
-                if doc.title != None:
-                    title = unidecode(doc.title)
-                if doc.source != None:
-                    source = unidecode(doc.source)
-
-                documents.append(
-                    {
-                        "title":title,
-                        "source":source,
-                        "year":doc.year,
-                        "authors":authors
-                    }
-
-                )
-
-        print "Number of docs: " + str(len(documents))
-        return documents
-
-
-
+            # modified_since also returns older documents which have since been edited
+            if doc.created.naive >= since:
+                yield self.convert_document(doc)
+
+    def convert_document(self, doc):
+
+        authors = []
+        if doc.authors != None:
+            for author in doc.authors:
+                first = ""
+                second = ""
+                if author.first_name != None:
+                    first = unidecode(author.first_name)
+                if author.last_name != None:
+                    second = unidecode(author.last_name)
+
+                authors.append({"first":first,"second":second})
+
+        title = ""
+        source = ""
+        if doc.title != None:
+            title = unidecode(doc.title)
+        if doc.source != None:
+            source = unidecode(doc.source)
+
+        return {
+            "id":doc.id,
+            "created":doc.created.naive,
+            "title":title,
+            "source":source,
+            "year":doc.year,
+            "authors":authors
+        }
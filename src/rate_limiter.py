@@ -0,0 +1,139 @@
+from evernote.edam.error.ttypes import EDAMSystemException
+
+import threading
+import logging
+import time
+
+# Evernote rate limits are applied over a rolling one hour window
+RATE_LIMIT_WINDOW = 3600
+
+# Fraction of the observed limit to run at once it has been hit
+RATE_LIMIT_SAFETY_FACTOR = 0.9
+
+# How much the learned rate is raised after a full window without hitting the limit
+RATE_RECOVERY_FACTOR = 1.1
+
+MAX_RATE_LIMIT_RETRIES = 5
+
+
+class AdaptiveRateLimiter():
+    # Token bucket which runs unthrottled until the first rate limit error, then learns the rate
+    # the service will accept from the number of calls made in the window and the rateLimitDuration.
+
+    def __init__(self, burst=10):
+        self.burst = burst
+        self.rate = None
+        self.tokens = burst
+        self.last_refill = time.time()
+        self.paused_until = 0
+        self.window_start = time.time()
+        self.window_calls = 0
+        self.last_rate_limited = None
+        self.queue_depth = 0
+        self.lock = threading.Lock()
+
+    def get_current_rate(self):
+        # Requests per second, or None when running at full speed
+        return self.rate
+
+    def get_queue_depth(self):
+        # Number of callers currently waiting for permission to make a request
+        return self.queue_depth
+
+    def acquire(self):
+
+        with self.lock:
+            self.queue_depth += 1
+
+        try:
+            while True:
+                with self.lock:
+                    wait_time = self.get_wait_time(time.time())
+                    if wait_time <= 0:
+                        self.window_calls += 1
+                        return
+                time.sleep(wait_time)
+        finally:
+            with self.lock:
+                self.queue_depth -= 1
+
+    def get_wait_time(self, now):
+        # Must be called holding the lock, consumes a token if no wait is needed
+
+        if now < self.paused_until:
+            return self.paused_until - now
+
+        if now - self.window_start > RATE_LIMIT_WINDOW:
+            self.start_new_window(now)
+
+        if self.rate is None:
+            return 0
+
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+
+        return (1 - self.tokens) / self.rate
+
+    def start_new_window(self, now):
+
+        if self.rate is not None and (self.last_rate_limited is None or self.last_rate_limited < self.window_start):
+            # A whole window passed without hitting the limit, so try going a little faster
+            self.rate = self.rate * RATE_RECOVERY_FACTOR
+
+        self.window_start = now
+        self.window_calls = 0
+
+    def report_rate_limited(self, rate_limit_duration):
+
+        with self.lock:
+            now = time.time()
+
+            window_length = (now - self.window_start) + rate_limit_duration
+            learned_rate = RATE_LIMIT_SAFETY_FACTOR * max(self.window_calls, 1) / window_length
+
+            if self.rate is None or learned_rate < self.rate:
+                self.rate = learned_rate
+
+            logging.info("Hit the Evernote rate limit after " + str(self.window_calls) + " calls, pausing for "
+                         + str(rate_limit_duration) + " seconds then limiting to " + str(self.rate) + " calls per second")
+
+            self.paused_until = max(self.paused_until, now + rate_limit_duration)
+            self.last_rate_limited = now
+            self.window_start = self.paused_until
+            self.window_calls = 0
+            self.tokens = 0
+            self.last_refill = self.paused_until
+
+
+class ThrottledNoteStore():
+    # Wraps a NoteStore so that every call goes through the rate limiter and
+    # calls which are rejected for exceeding the rate limit are retried after the limit resets
+
+    def __init__(self, note_store, rate_limiter):
+        self.note_store = note_store
+        self.rate_limiter = rate_limiter
+
+    def __getattr__(self, name):
+
+        method = getattr(self.note_store, name)
+        if not callable(method):
+            return method
+
+        def throttled_method(*args, **kwargs):
+
+            attempts = 0
+            while True:
+                self.rate_limiter.acquire()
+                try:
+                    return method(*args, **kwargs)
+                except EDAMSystemException as e:
+                    if e.rateLimitDuration is None or attempts == MAX_RATE_LIMIT_RETRIES:
+                        raise
+                    attempts += 1
+                    self.rate_limiter.report_rate_limited(e.rateLimitDuration)
+
+        return throttled_method
@@ -0,0 +1,29 @@
+import sqlite3
+import json
+
+
+class WeeklySummaryIndex():
+    # Maps each week's summary title to the summary note written for it, along with the (guid, update sequence number)
+    # of each daily log it was made from and a hash of its content, so unchanged weeks are never rewritten
+
+    def __init__(self, index_location):
+        self.connection = sqlite3.connect(index_location)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS weekly_summaries (week TEXT PRIMARY KEY, "
+                                "summary_guid TEXT NOT NULL, daily_logs TEXT NOT NULL, content_hash TEXT)")
+        self.connection.commit()
+
+    def get(self, week):
+        # Returns (summary guid, daily logs, content hash), or None if no summary has been written for the week.
+        # The content hash is None for summaries found in Evernote rather than written by the service.
+
+        row = self.connection.execute("SELECT summary_guid, daily_logs, content_hash FROM weekly_summaries WHERE week = ?",
+                                      (week,)).fetchone()
+        if row is None:
+            return None
+
+        return row[0], [tuple(daily_log) for daily_log in json.loads(row[1])], row[2]
+
+    def put(self, week, summary_guid, daily_logs, content_hash):
+        self.connection.execute("INSERT OR REPLACE INTO weekly_summaries (week, summary_guid, daily_logs, content_hash) "
+                                "VALUES (?, ?, ?, ?)", (week, summary_guid, json.dumps(daily_logs), content_hash))
+        self.connection.commit()
@@ -0,0 +1,305 @@
+# Measures how the jobs scale with the size of the account, running them against the in-process fakes in
+# fake_services.py. For each job and number of notes it reports the API calls made by method, the wall time and
+# the peak memory. Each measurement runs in its own process, so the peak memory of one doesn't hide another's.
+#
+# Run from the NoteService directory with e.g.
+#   python src/util/benchmark_jobs.py --sizes 10 1000 --latency 0.01
+#   python src/util/benchmark_jobs.py --baseline benchmark_baseline.json
+# With --baseline the call counts are compared with a previous run, and the script fails if any have gone up.
+
+from multiprocessing import Process, Queue
+from datetime import datetime, timedelta
+import argparse
+import resource
+import calendar
+import tempfile
+import logging
+import shutil
+import json
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from evernote_connector import GOAL_NOTEBOOKS
+from evernote_cache import EvernoteMetadataCache
+from evernote_sync import EvernoteSyncEngine
+from rate_limiter import AdaptiveRateLimiter
+from event_index import CalendarEventIndex
+from goal_state_store import GoalStateStore
+from summary_index import WeeklySummaryIndex
+from fake_services import FakeNoteStore, FakeEvernoteConnector, FakeCalendarService, FakeGoogleCalendarConnector, \
+    FakeMendeleySession, FakeMendeleyConnector
+
+DEFAULT_SIZES = [10, 1000, 100000]
+
+NOTE_CONTENT = ("<?xml version=\"1.0\" encoding=\"UTF-8\"?><!DOCTYPE en-note SYSTEM \"http://xml.evernote.com/pub/enml2.dtd\">"
+                "<en-note><div>Location: Somewhere</div><div>Note {index}</div><div>Some text about it</div></en-note>")
+
+# The notes are created an hour apart from here, so the daily logs span several years at the largest size
+FIRST_NOTE_TIME = datetime(2010, 1, 4)
+
+
+def get_note_time(index):
+    return FIRST_NOTE_TIME + timedelta(hours=index)
+
+
+def get_timestamp(at_datetime):
+    return calendar.timegm(at_datetime.timetuple()) * 1000
+
+
+def create_account(note_store, notebook_name, note_count, create_title):
+
+    notebook_guid = note_store.add_notebook(notebook_name)
+    for index in range(note_count):
+        note_store.add_note(notebook_guid, create_title(index), NOTE_CONTENT.format(index=index),
+                            get_timestamp(get_note_time(index)))
+
+    return notebook_guid
+
+
+class JobBenchmark():
+    # Sets up a fake account with note_count notes for the job in setup, then runs the job in run
+
+    def __init__(self, note_count, service_options):
+        self.note_count = note_count
+        self.working_directory = tempfile.mkdtemp()
+
+        self.note_store = FakeNoteStore(**service_options)
+        self.calendar_service = FakeCalendarService(**service_options)
+        self.mendeley_session = FakeMendeleySession(**service_options)
+
+        self.metadata_cache = EvernoteMetadataCache(os.path.join(self.working_directory, "evernote_cache.sqlite"))
+        self.evernote_client = FakeEvernoteConnector(self.note_store, self.metadata_cache, AdaptiveRateLimiter())
+        self.sync_engine = EvernoteSyncEngine(self.evernote_client, self.metadata_cache)
+
+    def get_fakes(self):
+        return [self.note_store, self.calendar_service, self.mendeley_session]
+
+    def setup(self):
+        pass
+
+    def run(self):
+        pass
+
+    def close(self):
+        shutil.rmtree(self.working_directory)
+
+
+class SyncBenchmark(JobBenchmark):
+    # The first sync of the metadata cache, which every other job starts with
+
+    def setup(self):
+        create_account(self.note_store, "Daily", self.note_count, lambda index: "Daily log " + str(index))
+
+    def run(self):
+        self.sync_engine.sync()
+
+
+class GoalsBenchmark(JobBenchmark):
+
+    def setup(self):
+
+        goal_notebook_guids = [self.note_store.add_notebook(notebook_name) for notebook_name in GOAL_NOTEBOOKS]
+        for index in range(self.note_count):
+            self.note_store.add_note(goal_notebook_guids[index % len(goal_notebook_guids)], "Goal " + str(index),
+                                     NOTE_CONTENT.format(index=index), get_timestamp(get_note_time(index)))
+
+        self.sync_engine.sync()
+        self.goal_state_store = GoalStateStore(os.path.join(self.working_directory, "goal_states.sqlite"))
+
+    def run(self):
+        self.evernote_client.process_goal_updates(self.goal_state_store, self.sync_engine)
+        self.goal_state_store.commit()
+
+
+class EventsBenchmark(JobBenchmark):
+
+    def setup(self):
+
+        create_account(self.note_store, "Events", self.note_count,
+                       lambda index: get_note_time(index).strftime("%Y-%m-%d %H00-%H30") + " Event " + str(index))
+
+        self.sync_engine.sync()
+        self.event_index = CalendarEventIndex(os.path.join(self.working_directory, "calendar_event_index.sqlite"))
+        self.google_client = FakeGoogleCalendarConnector(self.calendar_service)
+
+    def run(self):
+        events, invalid_notes = self.evernote_client.get_new_events("20000101T000000", self.sync_engine,
+                                                                    self.event_index)
+        self.google_client.sync_events(events, self.event_index)
+
+
+class MendeleyBenchmark(JobBenchmark):
+
+    def setup(self):
+
+        self.note_store.add_notebook("Literature")
+        self.note_store.add_tag("Authors")
+
+        # Each document has a few authors from a library wide pool, so most author tags are shared
+        author_count = max(1, int(self.note_count ** 0.5))
+        for index in range(self.note_count):
+            authors = [(u"First" + unicode(author_index), u"Author" + unicode(author_index))
+                       for author_index in set([index % author_count, (index * 7) % author_count])]
+            self.mendeley_session.add_document(u"Paper " + unicode(index) + u" & friends",
+                                               u"Journal <" + unicode(index % 10) + u">", 2000 + index % 20, authors,
+                                               get_note_time(index))
+
+        self.sync_engine.sync()
+        self.mendeley_client = FakeMendeleyConnector(self.mendeley_session)
+
+    def run(self):
+        self.evernote_client.add_new_mendeley_docs(self.mendeley_client.iter_new_documents(datetime(2000, 1, 1)))
+
+
+class SummaryBenchmark(JobBenchmark):
+    # Writes the weekly summaries for every week of daily logs, as the backfill does
+
+    def setup(self):
+
+        create_account(self.note_store, "Daily", self.note_count, lambda index: "Daily log " + str(index))
+        self.note_store.add_notebook("Summaries")
+
+        self.sync_engine.sync()
+        self.summary_index = WeeklySummaryIndex(os.path.join(self.working_directory, "summary_index.sqlite"))
+
+    def run(self):
+
+        weeks = []
+        week_start = FIRST_NOTE_TIME
+        week_note_metadata = []
+
+        for note_metadata in self.sync_engine.get_notes_created_between("Daily", 0, get_timestamp(datetime.utcnow())):
+            while note_metadata.created >= get_timestamp(week_start + timedelta(weeks=1)):
+                weeks.append((week_start.strftime("W/C %Y-%m-%d"), week_note_metadata))
+                week_start += timedelta(weeks=1)
+                week_note_metadata = []
+            week_note_metadata.append(note_metadata)
+        weeks.append((week_start.strftime("W/C %Y-%m-%d"), week_note_metadata))
+
+        self.evernote_client.sync_summary_logs("Summaries", weeks, self.summary_index, self.sync_engine)
+
+
+JOB_BENCHMARKS = [("sync", SyncBenchmark), ("goals", GoalsBenchmark), ("events", EventsBenchmark),
+                  ("mendeley", MendeleyBenchmark), ("summary", SummaryBenchmark)]
+
+
+def get_peak_memory():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_benchmark(benchmark_class, note_count, service_options, results):
+
+    benchmark = benchmark_class(note_count, service_options)
+    try:
+        benchmark.setup()
+        setup_memory = get_peak_memory()
+
+        for fake in benchmark.get_fakes():
+            fake.reset_counts()
+
+        start = time.time()
+        benchmark.run()
+        wall_time = time.time() - start
+
+        call_counts = {}
+        rate_limit_hits = 0
+        for fake in benchmark.get_fakes():
+            call_counts.update(fake.call_counts)
+            rate_limit_hits += fake.rate_limit_hits
+
+        results.put({"wall_time": wall_time, "call_counts": call_counts, "rate_limit_hits": rate_limit_hits,
+                     "setup_memory": setup_memory, "peak_memory": get_peak_memory()})
+    finally:
+        benchmark.close()
+
+
+def measure(benchmark_class, note_count, service_options):
+
+    results = Queue()
+    process = Process(target=run_benchmark, args=(benchmark_class, note_count, service_options, results))
+    process.start()
+    process.join()
+
+    if process.exitcode != 0:
+        raise RuntimeError(benchmark_class.__name__ + " failed with " + str(note_count) + " notes")
+
+    return results.get()
+
+
+def find_call_count_regressions(measurements, baseline):
+
+    regressions = []
+    for key, measurement in sorted(measurements.items()):
+        if key not in baseline:
+            continue
+        for method_name, call_count in sorted(measurement["call_counts"].items()):
+            baseline_count = baseline[key]["call_counts"].get(method_name, 0)
+            if call_count > baseline_count:
+                regressions.append(key + " " + method_name + ": " + str(baseline_count) + " -> " + str(call_count))
+
+    return regressions
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark the jobs against fake Evernote, Google and Mendeley services")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="numbers of notes to run with")
+    parser.add_argument("--jobs", nargs="+", default=[name for name, benchmark_class in JOB_BENCHMARKS],
+                        choices=[name for name, benchmark_class in JOB_BENCHMARKS])
+    parser.add_argument("--latency", type=float, default=0, help="seconds added to every request")
+    parser.add_argument("--rate-limit", type=int, default=None, help="requests allowed per service per hour")
+    parser.add_argument("--rate-limit-duration", type=int, default=1, help="seconds to wait once rate limited")
+    parser.add_argument("--baseline", help="JSON file of call counts to compare with, written if it doesn't exist")
+    args = parser.parse_args()
+
+    # The connectors log every note at debug level
+    logging.basicConfig(level=logging.WARNING)
+
+    service_options = {"latency": args.latency, "rate_limit": args.rate_limit,
+                       "rate_limit_duration": args.rate_limit_duration}
+
+    measurements = {}
+    print "%-10s %8s %10s %8s %10s %10s %10s  %s" % ("job", "notes", "wall (s)", "calls", "rate lim", "setup MB",
+                                                     "peak MB", "calls by method")
+
+    for job_name, benchmark_class in JOB_BENCHMARKS:
+        if job_name not in args.jobs:
+            continue
+
+        for note_count in args.sizes:
+            measurement = measure(benchmark_class, note_count, service_options)
+            measurements[job_name + "/" + str(note_count)] = measurement
+
+            print "%-10s %8d %10.2f %8d %10d %10.1f %10.1f  %s" % (
+                job_name, note_count, measurement["wall_time"], sum(measurement["call_counts"].values()),
+                measurement["rate_limit_hits"], measurement["setup_memory"], measurement["peak_memory"],
+                ", ".join(method_name + "=" + str(call_count)
+                          for method_name, call_count in sorted(measurement["call_counts"].items())))
+
+    if args.baseline is None:
+        return
+
+    if not os.path.exists(args.baseline):
+        with open(args.baseline, "w") as f:
+            json.dump(measurements, f, indent=2, sort_keys=True)
+        print "Saved the call counts to " + args.baseline
+        return
+
+    with open(args.baseline) as f:
+        regressions = find_call_count_regressions(measurements, json.load(f))
+
+    if len(regressions) > 0:
+        print "Call counts have gone up since the baseline:"
+        for regression in regressions:
+            print "  " + regression
+        sys.exit(1)
+
+    print "No call counts have gone up since the baseline"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# Compares the event title parser with the split and strptime parsing it replaced,
+# after checking it against a set of valid and invalid titles.
+# Run from the NoteService directory with: python src/util/benchmark_title_parser.py [number of titles]
+
+from datetime import datetime
+import random
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_title_parser import parse_event_title
+
+DEFAULT_TITLE_COUNT = 100000
+
+# Titles with the name the parser should find in them, or None if they should be rejected
+VALIDATION_TITLES = [
+    ("2000-10-01 1600-1700 Meeting", "Meeting"),
+    ("2000-10-01 16:00-17:30 Meeting", "Meeting"),
+    ("2000-10-01 1600-1700 2018 Annual review", "2018 Annual review"),
+    ("2000-10-01 1600-1700 100 days party", "100 days party"),
+    ("2000-10-01 1600-1700 10:30 standup notes", "10:30 standup notes"),
+    ("2000-10-01 Holiday", "Holiday"),
+    ("2000-10-01 3 day trip", "3 day trip"),
+    ("2000-10-01 - 2000-10-03 0900-1700 Conference", "Conference"),
+    ("2000-10-01 1600-17 Meeting", None),
+    ("2000-10-01 1600 Meeting", None),
+    ("2000-10-01 1600:1700 x", None),
+    ("2000-10-01 16:00 x", None),
+    ("2000-10-01 1600-1700", None),
+    ("2000-10-01 2500-2600 Invalid time", None),
+    ("2000-10-03 - 2000-10-01 Backwards", None),
+    ("Notes from 2000-10-01", None),
+]
+
+
+def parse_title_with_strptime(title):
+    # The previous implementation: validate the title, then split and strptime it again to extract the details
+
+    try:
+        split_title = title.split(" ", 2)
+
+        if len(split_title) != 3:
+            raise ValueError
+
+        datetime.strptime(split_title[0], '%Y-%m-%d')
+
+        if len(split_title[1].split("-")) != 2:
+            raise ValueError
+
+        datetime.strptime(split_title[1].split("-")[0], '%H%M')
+        datetime.strptime(split_title[1].split("-")[1], '%H%M')
+
+        if split_title[2] == "":
+            raise ValueError
+
+    except ValueError:
+        return None
+
+    split_title = title.split(" ", 2)
+
+    date_timestamp = datetime.strptime(split_title[0], '%Y-%m-%d')
+    start_string = split_title[1].split("-")[0]
+    end_string = split_title[1].split("-")[1]
+
+    start_timestamp = datetime.strptime(split_title[0] + " " + start_string, '%Y-%m-%d %H%M')
+    end_timestamp = datetime.strptime(split_title[0] + " " + end_string, '%Y-%m-%d %H%M')
+
+    return split_title[2], date_timestamp, start_timestamp, end_timestamp
+
+
+def generate_titles(count):
+    # Mostly valid titles in the original format, with some invalid ones as found in a real event notebook
+
+    random.seed(0)
+    titles = []
+
+    for index in range(count):
+        date = "20%02d-%02d-%02d" % (random.randint(0, 30), random.randint(1, 12), random.randint(1, 28))
+        hour = random.randint(0, 22)
+        times = "%02d%02d-%02d%02d" % (hour, random.choice([0, 15, 30, 45]), hour + 1, random.choice([0, 30]))
+
+        if index % 10 == 0:
+            titles.append("Notes from " + date)
+        elif index % 10 == 1:
+            titles.append(date + " 2500-2600 Invalid time " + str(index))
+        elif index % 10 == 2:
+            titles.append(date + " " + times + " " + str(index) + " reasons to start with a number")
+        else:
+            titles.append(date + " " + times + " Event number " + str(index))
+
+    return titles
+
+
+def find_validation_failures():
+
+    failures = []
+    for title, expected_name in VALIDATION_TITLES:
+        parsed_title = parse_event_title(title)
+        name = None if parsed_title is None else parsed_title.name
+        if name != expected_name:
+            failures.append("'" + title + "' parsed as " + repr(name) + ", expected " + repr(expected_name))
+
+    return failures
+
+
+def time_parser(parser, titles):
+
+    start = time.time()
+    valid_count = 0
+
+    for title in titles:
+        if parser(title) is not None:
+            valid_count += 1
+
+    return time.time() - start, valid_count
+
+
+def main():
+
+    failures = find_validation_failures()
+    if len(failures) > 0:
+        print "The parser doesn't handle these titles as expected:"
+        for failure in failures:
+            print "  " + failure
+        sys.exit(1)
+
+    title_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_TITLE_COUNT
+    titles = generate_titles(title_count)
+
+    strptime_time, strptime_valid = time_parser(parse_title_with_strptime, titles)
+    regex_time, regex_valid = time_parser(parse_event_title, titles)
+
+    print "Parsed " + str(title_count) + " titles"
+    print "split and strptime: %.3fs (%d valid)" % (strptime_time, strptime_valid)
+    print "event_title_parser: %.3fs (%d valid)" % (regex_time, regex_valid)
+    print "speedup: %.1fx" % (strptime_time / regex_time)
+
+
+if __name__ == "__main__":
+    main()
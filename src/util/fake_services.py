@@ -0,0 +1,490 @@
+# In-process fakes of the Evernote NoteStore, Google Calendar and Mendeley APIs used by the connectors,
+# so the jobs can be run and measured without touching the real services. Each fake counts its calls by method,
+# and can add a fixed latency to every request and reject requests over a rate limit as the real service would.
+
+from evernote.edam.type.ttypes import Note, Notebook, Tag
+from evernote.edam.notestore.ttypes import SyncState, SyncChunk, NoteMetadata, NotesMetadataList
+from evernote.edam.error.ttypes import EDAMSystemException, EDAMUserException, EDAMNotFoundException, EDAMErrorCode
+from apiclient.errors import HttpError
+from mendeley.exception import MendeleyApiException
+
+from evernote_connector import EvernoteConnector
+from gcalender_connector import GoogleCalendarConnector
+from mendeley_connector import MendeleyConnector
+
+from datetime import datetime
+from bisect import bisect_right
+import itertools
+import threading
+import inspect
+import httplib2
+import uuid
+import copy
+import json
+import time
+
+
+def get_timestamp():
+    # Milliseconds since the epoch, as used by Evernote
+    return int(time.time() * 1000)
+
+
+class SimulatedService():
+
+    def __init__(self, latency=0, rate_limit=None, rate_limit_window=3600, rate_limit_duration=1):
+        # latency is the seconds added to every request. When rate_limit is set, requests after the first rate_limit
+        # in a window of rate_limit_window seconds are rejected, asking the caller to wait rate_limit_duration seconds.
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self.rate_limit_duration = rate_limit_duration
+
+        self.call_counts = {}
+        self.rate_limit_hits = 0
+        self.window_start = None
+        self.window_calls = 0
+        self.lock = threading.Lock()
+
+    def call(self, method_name, add_latency=True):
+        # Records a request, returning the seconds to wait if it is over the rate limit, otherwise None
+
+        rate_limit_duration = None
+
+        with self.lock:
+            self.call_counts[method_name] = self.call_counts.get(method_name, 0) + 1
+
+            if self.rate_limit is not None:
+                now = time.time()
+                if self.window_start is None or now - self.window_start >= self.rate_limit_window:
+                    self.window_start = now
+                    self.window_calls = 0
+
+                self.window_calls += 1
+                if self.window_calls > self.rate_limit:
+                    self.rate_limit_hits += 1
+                    rate_limit_duration = self.rate_limit_duration
+                    # The next window starts once the caller has waited
+                    self.window_start = now + self.rate_limit_duration - self.rate_limit_window
+
+        if add_latency and self.latency > 0:
+            time.sleep(self.latency)
+
+        return rate_limit_duration
+
+    def get_call_count(self):
+        with self.lock:
+            return sum(self.call_counts.values())
+
+    def reset_counts(self):
+        with self.lock:
+            self.call_counts = {}
+            self.rate_limit_hits = 0
+
+
+class FakeNoteStore(SimulatedService):
+    # Implements the NoteStore methods the service uses, with the same argument names as the Thrift client
+
+    def __init__(self, **kwargs):
+        SimulatedService.__init__(self, **kwargs)
+
+        self.notebooks = {}
+        self.tags = {}
+        self.notes = {}
+
+        self.update_count = 0
+        # Every object's USN in order, and the object currently at each USN, for getFilteredSyncChunk
+        self.usns = []
+        self.objects_by_usn = {}
+        self.guids = itertools.count(1)
+        self.data_lock = threading.RLock()
+
+    def check_rate_limit(self, method_name):
+        rate_limit_duration = self.call(method_name)
+        if rate_limit_duration is not None:
+            raise EDAMSystemException(errorCode=EDAMErrorCode.RATE_LIMIT_REACHED, rateLimitDuration=rate_limit_duration)
+
+    def create_guid(self):
+        return str(uuid.UUID(int=next(self.guids)))
+
+    def record_update(self, evernote_object):
+        # Must be called holding the data lock
+
+        if evernote_object.updateSequenceNum is not None:
+            self.objects_by_usn.pop(evernote_object.updateSequenceNum, None)
+
+        self.update_count += 1
+        evernote_object.updateSequenceNum = self.update_count
+        self.usns.append(self.update_count)
+        self.objects_by_usn[self.update_count] = evernote_object
+
+    # These set up the account without counting as requests
+
+    def add_notebook(self, name):
+        with self.data_lock:
+            notebook = Notebook(guid=self.create_guid(), name=name)
+            self.record_update(notebook)
+            self.notebooks[notebook.guid] = notebook
+            return notebook.guid
+
+    def add_tag(self, name, parent_guid=None):
+        with self.data_lock:
+            tag = Tag(guid=self.create_guid(), name=name, parentGuid=parent_guid)
+            self.record_update(tag)
+            self.tags[tag.guid] = tag
+            return tag.guid
+
+    def add_note(self, notebook_guid, title, content, created=None):
+        with self.data_lock:
+            if created is None:
+                created = get_timestamp()
+            note = Note(guid=self.create_guid(), title=title, content=content, notebookGuid=notebook_guid,
+                        created=created, updated=created, active=True, tagGuids=[])
+            self.record_update(note)
+            self.notes[note.guid] = note
+            return note.guid
+
+    def move_note(self, note_guid, notebook_guid):
+        with self.data_lock:
+            note = self.notes[note_guid]
+            note.notebookGuid = notebook_guid
+            self.record_update(note)
+
+    def copy_note(self, note, with_content):
+        note_copy = copy.copy(note)
+        note_copy.tagGuids = list(note.tagGuids or [])
+        if not with_content:
+            note_copy.content = None
+        return note_copy
+
+    # NoteStore methods
+
+    def getSyncState(self, authenticationToken):
+        self.check_rate_limit("getSyncState")
+
+        with self.data_lock:
+            return SyncState(currentTime=get_timestamp(), fullSyncBefore=0, updateCount=self.update_count, uploaded=0)
+
+    def getFilteredSyncChunk(self, authenticationToken, afterUSN, maxEntries, filter):
+        self.check_rate_limit("getFilteredSyncChunk")
+
+        with self.data_lock:
+            chunk = SyncChunk(currentTime=get_timestamp(), updateCount=self.update_count, notes=[], notebooks=[], tags=[])
+
+            entry_count = 0
+            usn_index = bisect_right(self.usns, afterUSN)
+            while usn_index < len(self.usns) and entry_count < maxEntries:
+
+                usn = self.usns[usn_index]
+                usn_index += 1
+
+                evernote_object = self.objects_by_usn.get(usn)
+                if evernote_object is None:
+                    # the object has been updated since, and is included at its later USN
+                    continue
+
+                entry_count += 1
+                chunk.chunkHighUSN = usn
+
+                if isinstance(evernote_object, Note) and filter.includeNotes:
+                    chunk.notes.append(self.copy_note(evernote_object, with_content=False))
+                elif isinstance(evernote_object, Notebook) and filter.includeNotebooks:
+                    chunk.notebooks.append(copy.copy(evernote_object))
+                elif isinstance(evernote_object, Tag) and filter.includeTags:
+                    chunk.tags.append(copy.copy(evernote_object))
+
+            return chunk
+
+    def listNotebooks(self, authenticationToken):
+        self.check_rate_limit("listNotebooks")
+
+        with self.data_lock:
+            return [copy.copy(notebook) for notebook in self.notebooks.values()]
+
+    def listTags(self, authenticationToken):
+        self.check_rate_limit("listTags")
+
+        with self.data_lock:
+            return [copy.copy(tag) for tag in self.tags.values()]
+
+    def findNotesMetadata(self, authenticationToken, filter, offset, maxNotes, resultSpec):
+        # Only the notebook and direction of the filter are applied, with the notes ordered by creation time
+        self.check_rate_limit("findNotesMetadata")
+
+        with self.data_lock:
+            notes = sorted((note for note in self.notes.values()
+                            if note.active and filter.notebookGuid in (None, note.notebookGuid)),
+                           key=lambda note: note.created, reverse=filter.ascending is False)
+
+            return NotesMetadataList(startIndex=offset, totalNotes=len(notes),
+                                     notes=[NoteMetadata(guid=note.guid, title=note.title, created=note.created,
+                                                         updated=note.updated, notebookGuid=note.notebookGuid,
+                                                         updateSequenceNum=note.updateSequenceNum)
+                                            for note in notes[offset:offset + maxNotes]])
+
+    def getNote(self, authenticationToken, guid, withContent, withResourcesData, withResourcesRecognition,
+                withResourcesAlternateData):
+        self.check_rate_limit("getNote")
+
+        with self.data_lock:
+            if guid not in self.notes:
+                raise EDAMNotFoundException(identifier="Note.guid", key=guid)
+            return self.copy_note(self.notes[guid], withContent)
+
+    def updateNote(self, authenticationToken, note):
+        self.check_rate_limit("updateNote")
+
+        with self.data_lock:
+            if note.guid not in self.notes:
+                raise EDAMNotFoundException(identifier="Note.guid", key=note.guid)
+
+            stored_note = self.notes[note.guid]
+            stored_note.title = note.title
+            if note.content is not None:
+                stored_note.content = note.content
+            if note.notebookGuid is not None:
+                stored_note.notebookGuid = note.notebookGuid
+            if note.tagGuids is not None:
+                stored_note.tagGuids = list(note.tagGuids)
+            stored_note.updated = get_timestamp()
+            self.record_update(stored_note)
+
+            return self.copy_note(stored_note, with_content=False)
+
+    def createNote(self, authenticationToken, note):
+        self.check_rate_limit("createNote")
+
+        with self.data_lock:
+            if note.notebookGuid not in self.notebooks:
+                raise EDAMNotFoundException(identifier="Note.notebookGuid", key=note.notebookGuid)
+            if not note.title:
+                raise EDAMUserException(errorCode=EDAMErrorCode.BAD_DATA_FORMAT, parameter="Note.title")
+
+            note_guid = self.add_note(note.notebookGuid, note.title, note.content)
+            self.notes[note_guid].tagGuids = list(note.tagGuids or [])
+
+            return self.copy_note(self.notes[note_guid], with_content=False)
+
+    def createTag(self, authenticationToken, tag):
+        self.check_rate_limit("createTag")
+
+        with self.data_lock:
+            if any(existing_tag.name.lower() == tag.name.lower() for existing_tag in self.tags.values()):
+                raise EDAMUserException(errorCode=EDAMErrorCode.DATA_CONFLICT, parameter="Tag.name")
+
+            return copy.copy(self.tags[self.add_tag(tag.name, tag.parentGuid)])
+
+
+class FakeStore():
+    # Passes the authentication token to methods called without it, as evernote.api.client.Store does
+
+    def __init__(self, token, note_store):
+        self.token = token
+        self.note_store = note_store
+
+    def __getattr__(self, name):
+
+        method = getattr(self.note_store, name)
+        argument_names = inspect.getargspec(method).args
+
+        def delegate_method(*args, **kwargs):
+            if "authenticationToken" in argument_names and len(args) + 1 < len(argument_names):
+                return method(self.token, *args, **kwargs)
+            return method(*args, **kwargs)
+
+        return delegate_method
+
+
+class FakeEvernoteConnector(EvernoteConnector):
+
+    def __init__(self, note_store, metadata_cache=None, rate_limiter=None):
+        EvernoteConnector.__init__(self, token="fake-token", sandbox=True, metadata_cache=metadata_cache,
+                                   rate_limiter=rate_limiter)
+        self.fake_note_store = note_store
+
+    def create_note_store(self):
+        return FakeStore(self.token, self.fake_note_store)
+
+
+class FakeCalendarRequest():
+
+    def __init__(self, service, method_name, run):
+        self.service = service
+        self.method_name = method_name
+        self.run = run
+
+    def execute(self, add_latency=True):
+
+        rate_limit_duration = self.service.call(self.method_name, add_latency)
+        if rate_limit_duration is not None:
+            raise HttpError(httplib2.Response({"status": 429}),
+                            json.dumps({"error": {"code": 429, "message": "Rate Limit Exceeded"}}))
+
+        return self.run()
+
+
+class FakeBatchHttpRequest():
+
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request_id, request, callback or self.callback))
+
+    def execute(self):
+        # All the requests are sent in a single HTTP request, so the latency is only added once
+
+        self.service.call("batch")
+
+        for request_id, request, callback in self.requests:
+            try:
+                response, exception = request.execute(add_latency=False), None
+            except HttpError as e:
+                response, exception = None, e
+            callback(request_id, response, exception)
+
+
+class FakeCalendarEvents():
+
+    def __init__(self, service):
+        self.service = service
+
+    def insert(self, calendarId, body):
+
+        def run():
+            with self.service.data_lock:
+                event_id = body.get("id") or self.service.create_event_id()
+                if event_id in self.service.calendar_events:
+                    raise HttpError(httplib2.Response({"status": 409}),
+                                    json.dumps({"error": {"code": 409, "message": "The requested identifier already exists."}}))
+
+                self.service.calendar_events[event_id] = dict(body, id=event_id)
+                return self.service.calendar_events[event_id]
+
+        return FakeCalendarRequest(self.service, "events.insert", run)
+
+    def patch(self, calendarId, eventId, body):
+
+        def run():
+            with self.service.data_lock:
+                if eventId not in self.service.calendar_events:
+                    raise HttpError(httplib2.Response({"status": 404}),
+                                    json.dumps({"error": {"code": 404, "message": "Not Found"}}))
+
+                self.service.calendar_events[eventId].update(body)
+                return self.service.calendar_events[eventId]
+
+        return FakeCalendarRequest(self.service, "events.patch", run)
+
+
+class FakeCalendarService(SimulatedService):
+    # Implements the parts of the Google Calendar v3 service object used by GoogleCalendarConnector
+
+    def __init__(self, **kwargs):
+        SimulatedService.__init__(self, **kwargs)
+        self.calendar_events = {}
+        self.event_ids = itertools.count(1)
+        self.data_lock = threading.Lock()
+
+    def create_event_id(self):
+        return "fake" + str(next(self.event_ids))
+
+    def events(self):
+        return FakeCalendarEvents(self)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatchHttpRequest(self, callback)
+
+
+class FakeGoogleCalendarConnector(GoogleCalendarConnector):
+
+    def __init__(self, service):
+        self.service = service
+
+
+class FakeMendeleyResponse():
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self):
+        return {"message": self.text}
+
+
+class FakeArrow():
+    # The part of the arrow timestamps returned by the Mendeley SDK used by the connector
+
+    def __init__(self, naive):
+        self.naive = naive
+
+
+class FakeMendeleyPerson():
+
+    def __init__(self, first_name, last_name):
+        self.first_name = first_name
+        self.last_name = last_name
+
+
+class FakeMendeleyDocument():
+
+    def __init__(self, document_id, title, source, year, authors, created, tags=None):
+        self.id = document_id
+        self.title = title
+        self.source = source
+        self.year = year
+        self.authors = [FakeMendeleyPerson(first_name, last_name) for first_name, last_name in authors]
+        self.created = FakeArrow(created)
+        self.last_modified = FakeArrow(created)
+        self.tags = tags
+
+
+class FakeMendeleyDocuments():
+
+    def __init__(self, session):
+        self.session = session
+
+    def iter(self, page_size=None, view=None, sort=None, order=None, modified_since=None, deleted_since=None):
+        # Yields the library a page at a time, with a request for each page
+
+        documents = self.session.documents_in_library
+        if modified_since is not None:
+            since = datetime.strptime(modified_since, '%Y-%m-%dT%H:%M:%SZ')
+            documents = [document for document in documents if document.last_modified.naive > since]
+        if sort is not None:
+            documents = sorted(documents, key=lambda document: getattr(document, sort).naive, reverse=(order == 'desc'))
+
+        page_size = page_size or 20
+        for page_start in range(0, len(documents), page_size):
+
+            if self.session.call("documents.list") is not None:
+                raise MendeleyApiException(FakeMendeleyResponse(429, "Rate limit exceeded"))
+
+            for document in documents[page_start:page_start + page_size]:
+                yield document
+
+
+class FakeMendeleySession(SimulatedService):
+    # Implements the parts of MendeleySession used by MendeleyConnector
+
+    def __init__(self, **kwargs):
+        SimulatedService.__init__(self, **kwargs)
+        self.documents_in_library = []
+        self.documents = FakeMendeleyDocuments(self)
+
+    def add_document(self, title, source, year, authors, created, tags=None):
+        # authors is a list of (first name, last name)
+
+        document = FakeMendeleyDocument(str(uuid.uuid4()), title, source, year, authors, created, tags)
+        self.documents_in_library.append(document)
+        return document.id
+
+
+class FakeMendeleyConnector(MendeleyConnector):
+
+    def __init__(self, session):
+        self.session = session
+
+    def refresh_token_if_expired(self):
+        pass
@@ -0,0 +1,119 @@
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from urlparse import urlparse, parse_qs
+from collections import OrderedDict
+import threading
+import logging
+import json
+
+# Notifications are handled once none have arrived for this many seconds, so a burst of edits is processed once
+DEBOUNCE_SECONDS = 5
+
+
+class WebhookNotification():
+    def __init__(self, note_guid, notebook_guid, reason):
+        self.note_guid = note_guid
+        self.notebook_guid = notebook_guid
+        self.reason = reason
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    # Evernote sends its notifications as a GET with the details in the query string, e.g.
+    # /?userId=1234&guid=[note guid]&notebookGuid=[notebook guid]&reason=update
+    # The same parameters are also accepted as a form or JSON encoded POST.
+
+    def do_GET(self):
+        self.receive_notification(parse_qs(urlparse(self.path).query))
+
+    def do_POST(self):
+
+        body = self.rfile.read(int(self.headers.getheader('content-length', 0)))
+
+        if self.headers.gettype() == 'application/json':
+            try:
+                parameters = dict((key, [value]) for key, value in json.loads(body).items())
+            except ValueError:
+                self.send_response(400)
+                self.end_headers()
+                return
+        else:
+            parameters = parse_qs(body)
+
+        parameters.update(parse_qs(urlparse(self.path).query))
+        self.receive_notification(parameters)
+
+    def receive_notification(self, parameters):
+
+        if "guid" not in parameters:
+            self.send_response(400)
+            self.end_headers()
+            return
+
+        notification = WebhookNotification(parameters["guid"][0],
+                                           parameters.get("notebookGuid", [None])[0],
+                                           parameters.get("reason", [None])[0])
+        self.server.receiver.add_notification(notification)
+
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logging.debug("Webhook request from " + self.client_address[0] + ": " + (format % args))
+
+
+class WebhookReceiver():
+    # Listens for Evernote webhook notifications and passes them to handle_notifications in batches,
+    # with at most one notification per note in each batch
+
+    def __init__(self, port, handle_notifications, debounce_seconds=DEBOUNCE_SECONDS):
+        self.handle_notifications = handle_notifications
+        self.debounce_seconds = debounce_seconds
+
+        self.pending_notifications = OrderedDict()
+        self.timer = None
+        self.lock = threading.Lock()
+
+        self.server = HTTPServer(("", port), WebhookRequestHandler)
+        self.server.receiver = self
+
+    def start(self):
+
+        thread = threading.Thread(target=self.server.serve_forever, name="WebhookReceiver")
+        thread.daemon = True
+        thread.start()
+
+        logging.info("Listening for Evernote webhook notifications on port " + str(self.server.server_address[1]))
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_notification(self, notification):
+
+        logging.debug("Received " + str(notification.reason) + " notification for note " + notification.note_guid)
+
+        with self.lock:
+            # A later notification for the same note replaces the earlier one
+            self.pending_notifications.pop(notification.note_guid, None)
+            self.pending_notifications[notification.note_guid] = notification
+
+            if self.timer is not None:
+                self.timer.cancel()
+
+            self.timer = threading.Timer(self.debounce_seconds, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+
+        with self.lock:
+            notifications = list(self.pending_notifications.values())
+            self.pending_notifications = OrderedDict()
+            self.timer = None
+
+        if len(notifications) == 0:
+            return
+
+        try:
+            self.handle_notifications(notifications)
+        except Exception as e:
+            logging.critical("There was an error handling webhook notifications: " + str(getattr(e, 'msg', e)))